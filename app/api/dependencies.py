@@ -1,7 +1,7 @@
 from fastapi import WebSocket, WebSocketException, security, Depends, HTTPException
 import jwt
 from sqlmodel import select
-from ..core.database import SessionDep
+from ..core.database import AsyncSessionDep
 from app.models.db import User
 from app.core.config import get_settings
 
@@ -14,8 +14,8 @@ oauth2_scheme = security.OAuth2PasswordBearer(
 )
 
 
-def get_current_user(
-    session: SessionDep, token: str = Depends(oauth2_scheme)
+async def get_current_user(
+    session: AsyncSessionDep, token: str = Depends(oauth2_scheme)
 ) -> User | None:
     """
     Decode the access token and return the user information.
@@ -32,7 +32,7 @@ def get_current_user(
                 detail="Invalid token",
             )
 
-        result = session.exec(select(User).where(User.email == username))
+        result = await session.exec(select(User).where(User.email == username))
         user = result.first()
 
         return user
@@ -56,14 +56,14 @@ def require_admin(user: User = Depends(get_current_user)) -> User | None:
     return user
 
 
-async def get_ws_user(websocket: WebSocket, session: SessionDep) -> User | None:
+async def get_ws_user(websocket: WebSocket, session: AsyncSessionDep) -> User | None:
     token = websocket.headers.get("sec-websocket-protocol")
 
     if not token:
         raise WebSocketException(code=1008, reason="404: Missing token")
 
     try:
-        user = get_current_user(session, token)
+        user = await get_current_user(session, token)
 
         if not user:
             raise WebSocketException(code=1008, reason="404: No user found")
@@ -0,0 +1,64 @@
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Rejects uploads larger than the limit with a 413: right away when the
+    declared Content-Length exceeds it, and otherwise, for instance for
+    chunked bodies, as soon as more body bytes than that have arrived.
+    """
+
+    def __init__(self, app: ASGIApp, paths: list[str], max_bytes: int):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length", "")
+
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        rejected = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, rejected
+
+            if rejected:
+                return {"type": "http.disconnect"}
+
+            message = await receive()
+
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+
+                if received > self.max_bytes:
+                    rejected = True
+                    await self._reject(scope, receive, send)
+                    # the app stops reading as if the client went away
+                    return {"type": "http.disconnect"}
+
+            return message
+
+        async def guarded_send(message: Message) -> None:
+            # the 413 has already been sent
+            if not rejected:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise
+
+    async def _reject(self, scope: Scope, receive: Receive, send: Send):
+        response = JSONResponse({"detail": "Image file too large."}, status_code=413)
+        await response(scope, receive, send)
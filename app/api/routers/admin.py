@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends
+from app.core.image_processor import image_processor
+from app.models.schemas import ImageStatsReturn
+from app.utils.image import data_url_cache
+from ..dependencies import require_admin
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(require_admin)],
+)
+
+
+@router.get(
+    path="/images/stats",
+    response_model=ImageStatsReturn,
+    summary="Get image pool and cache counters",
+    description="""
+    Returns the queue depth and job counters of the image worker pool, and the
+    size and hit/miss counters of the data-URL cache. Only accessible to admin users.
+    """,
+)
+async def get_image_stats() -> ImageStatsReturn:
+    return ImageStatsReturn(
+        pool=image_processor.stats(), data_url_cache=data_url_cache.stats()
+    )
@@ -5,12 +5,11 @@ from datetime import datetime, timedelta, timezone
 import jwt
 from ..dependencies import require_admin
 from sqlmodel import select
-from app.core.database import SessionDep
+from app.core.database import AsyncSessionDep
 from app.models.schemas import Token
 from app.models.db import User
 from app.core.config import get_settings
 
-
 settings = get_settings()
 
 router = APIRouter(
@@ -44,7 +43,7 @@ router = APIRouter(
     },
 )
 async def register_user(
-    session: SessionDep,
+    session: AsyncSessionDep,
     username: EmailStr = Form(
         ...,
         description="Email address of the new user",
@@ -73,7 +72,7 @@ async def register_user(
     if not any(char.islower() for char in password):
         raise HTTPException(400, "Password must contain at least one lowercase letter")
 
-    result = session.exec(select(User).where(User.email == username.lower()))
+    result = await session.exec(select(User).where(User.email == username.lower()))
     user_in_db = result.first()
 
     if user_in_db:
@@ -86,8 +85,8 @@ async def register_user(
     )
 
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    await session.commit()
+    await session.refresh(user)
 
     return JSONResponse({"detail": f"User {username} registered successfully"}, 201)
 
@@ -109,7 +108,7 @@ async def register_user(
     },
 )
 async def login_user(
-    session: SessionDep,
+    session: AsyncSessionDep,
     response: Response,
     form_data: security.OAuth2PasswordRequestForm = Depends(
         security.OAuth2PasswordRequestForm
@@ -125,7 +124,7 @@ async def login_user(
 
     statement = select(User).where(User.email == form_data.username)
 
-    user = session.exec(statement).first()
+    user = (await session.exec(statement)).first()
 
     if not user or not settings.pwd_context.verify(
         form_data.password, user.hashed_password
@@ -187,7 +186,7 @@ async def login_user(
 async def refresh_token(
     request: Request,
     response: Response,
-    session: SessionDep,
+    session: AsyncSessionDep,
 ):
     """
     Refresh the access token using the refresh token cookie.
@@ -211,7 +210,7 @@ async def refresh_token(
         username: str = payload.get("sub", "")
         statement = select(User).where(User.email == username)
 
-        result = session.exec(statement)
+        result = await session.exec(statement)
         user_in_db = result.first()
 
         if not username or not user_in_db:
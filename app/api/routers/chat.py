@@ -1,25 +1,41 @@
-from uuid import UUID
-from agents import TResponseInputItem
+import asyncio
 from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
     WebSocket,
+    WebSocketDisconnect,
     UploadFile,
     File,
 )
-from sqlmodel import select, desc
 from app.core import visit_manager
-from app.core.database import SessionDep
+from app.core.database import AsyncSessionDep, db
 from app.core.visit_manager import VisitDep
 from app.models.db import User, Message
 from app.core.socket_manager import socket_manager
+from app.core.image_processor import image_processor
+from app.core.canvas_store import CanvasState, canvas_store
+from app.services.context_builder import generate_input_items
+from app.services.deletion_queue import deletion_queue
+from app.services.message_writer import message_writer
+from app.utils.image import ImageTooLargeError
+from app.utils.tokens import (
+    MESSAGE_OVERHEAD_TOKENS,
+    estimate_image_tokens,
+    message_tokens,
+)
 from ..dependencies import (
     get_current_user,
     get_ws_user,
 )
-from app.utils.image import convert_to_png_and_save, image_to_base64
-from app.models.schemas import DrawRequest, ImageReturn, Line
+from app.models.schemas import (
+    CompactLine,
+    DrawDeltaRequest,
+    DrawDeltaReturn,
+    DrawRequest,
+    ImageReturn,
+    Line,
+)
 from app.core.config import get_settings
 from typing import List
 
@@ -27,48 +43,7 @@ router = APIRouter(prefix="/chat", tags=["chat"])
 
 settings = get_settings()
 
-
-def generate_input_items(
-    session: SessionDep, user_id: UUID
-) -> list[TResponseInputItem]:
-    conversation_history = session.exec(
-        select(Message)
-        .where(Message.user_id == user_id)
-        .order_by(desc(Message.timestamp))
-    ).fetchmany(5)
-
-    # TODO: add RAG to find relevance
-
-    input_items: list[TResponseInputItem] = []
-
-    for message in conversation_history.__reversed__():
-        if message.role == "user" or message.role == "assistant":
-            if message.image_filename != None:
-                file_path = f"{settings.uploads_dir}/{message.image_filename}"
-                b64_image = image_to_base64(file_path)
-
-                input_items.append(
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "input_image",
-                                "detail": "auto",
-                                "image_url": f"data:image/jpeg;base64,{b64_image}",
-                            }
-                        ],
-                    }
-                )
-
-            input_items.append(
-                {
-                    "role": message.role,
-                    "type": "message",
-                    "content": message.content,
-                }
-            )
-
-    return input_items
+STOP_MESSAGE = "[STOP]"
 
 
 @router.post(
@@ -83,10 +58,11 @@ def generate_input_items(
         200: {"description": "Image uploaded and critiqued successfully"},
         400: {"description": "Invalid image file or file type"},
         401: {"description": "Unauthorized"},
+        413: {"description": "Image file too large"},
     },
 )
 async def critique_image(
-    session: SessionDep,
+    session: AsyncSessionDep,
     visit: VisitDep,
     file: UploadFile = File(..., description="PNG image file to upload"),
     user: User = Depends(get_current_user),
@@ -107,16 +83,27 @@ async def critique_image(
     if websocket is None:
         raise HTTPException(status_code=400, detail="No active websocket for user.")
 
-    contents = await file.read()
+    await deletion_queue.wait_for(user.id)
 
     try:
-        filename = convert_to_png_and_save(contents, user_id=str(user.id))
+        stored = await image_processor.save_upload(file.file, user_id=str(user.id))
+    except ImageTooLargeError:
+        raise HTTPException(status_code=413, detail="Image file too large.")
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid image file.")
 
-    input_items = generate_input_items(session, user.id)
+    filename = stored.filename
 
-    b64_image = image_to_base64(f"{settings.uploads_dir}/{filename}")
+    await message_writer.wait_for(user.id)
+
+    input_items = await generate_input_items(
+        session,
+        user.id,
+        visit.session_id,
+        newer_phashes=[stored.phash] if stored.phash else None,
+        reserved_tokens=MESSAGE_OVERHEAD_TOKENS
+        + estimate_image_tokens(stored.width, stored.height),
+    )
 
     input_items.append(
         {
@@ -125,7 +112,7 @@ async def critique_image(
                 {
                     "type": "input_image",
                     "detail": "auto",
-                    "image_url": f"data:image/jpeg;base64,{b64_image}",
+                    "image_url": await image_processor.data_url(filename),
                 }
             ],
         },
@@ -145,15 +132,13 @@ async def critique_image(
         session_id=visit.session_id,
         role="assistant",
         image_filename=filename,
+        image_phash=stored.phash,
+        token_count=message_tokens(full_critique, (stored.width, stored.height)),
     )
 
-    session.add(message)
-    session.commit()
-    session.refresh(message)
+    message_writer.add([message])
 
-    return ImageReturn(
-        filename=filename, size=len(contents), message_id=str(message.id)
-    )
+    return ImageReturn(filename=filename, size=stored.size, message_id=str(message.id))
 
 
 @router.post(
@@ -168,83 +153,273 @@ async def continue_drawing(
     return new_lines
 
 
+@router.post(
+    path="/draw/delta",
+    response_model=DrawDeltaReturn,
+    dependencies=[Depends(get_current_user)],
+    summary="Continue a drawing from the lines added since a revision",
+    description="""
+    Send only the lines drawn since `base_revision`; the server keeps the rest of
+    the canvas for the active visit. Send `base_revision: null` with all lines to
+    start over, for instance after an undo or when the canvas was cleared.
+    Returns the generated lines and the new revision, which already includes them.
+    """,
+    responses={
+        409: {"description": "Base revision does not match the server's canvas"},
+    },
+)
+async def continue_drawing_delta(
+    req: DrawDeltaRequest,
+    visit: VisitDep,
+):
+    canvas = canvas_store.get(visit.session_id)
+
+    async with canvas.lock:
+        lines = _canvas_input(canvas, req)
+
+        new_lines = await visit.draw(lines=lines)
+
+        revision = _save_canvas_delta(canvas, req, new_lines)
+
+    return DrawDeltaReturn(revision=revision, lines=new_lines)
+
+
+@router.post(
+    path="/draw/stream",
+    response_model=DrawDeltaReturn,
+    summary="Continue a drawing, streaming new lines over the websocket",
+    description="""
+    Like `/chat/draw/delta`, but every generated line is pushed to the user's
+    websocket as `[LINE]{...}` as soon as it is complete, followed by
+    `[DRAW_END]`, or by `[DRAW_ERROR]` when drawing fails. The response holds
+    all generated lines and the new revision.
+    """,
+    responses={
+        400: {"description": "No active websocket for user"},
+        409: {"description": "Base revision does not match the server's canvas"},
+    },
+)
+async def continue_drawing_stream(
+    req: DrawDeltaRequest,
+    visit: VisitDep,
+    user: User = Depends(get_current_user),
+):
+    websocket = socket_manager.get(str(user.id))
+
+    if websocket is None:
+        raise HTTPException(status_code=400, detail="No active websocket for user.")
+
+    canvas = canvas_store.get(visit.session_id)
+
+    async with canvas.lock:
+        lines = _canvas_input(canvas, req)
+
+        new_lines: list[Line] = []
+
+        try:
+            async for line in visit.draw_stream(lines=lines):
+                await websocket.send_text(f"[LINE]{line.model_dump_json()}")
+                new_lines.append(line)
+        except BaseException:
+            # the client may have received lines already and waits for an end
+            try:
+                await websocket.send_text("[DRAW_ERROR]")
+            except (RuntimeError, WebSocketDisconnect):
+                pass
+
+            raise
+
+        await websocket.send_text("[DRAW_END]")
+
+        revision = _save_canvas_delta(canvas, req, new_lines)
+
+    return DrawDeltaReturn(revision=revision, lines=new_lines)
+
+
+def _canvas_input(canvas: CanvasState, req: DrawDeltaRequest) -> list[Line]:
+    """
+    Returns the canvas with the delta applied, leaving the stored canvas as it
+    is until the drawing succeeds.
+    """
+    if req.base_revision is None:
+        lines = []
+    elif req.base_revision != canvas.revision:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Canvas is at revision {canvas.revision}",
+        )
+    else:
+        lines = canvas.lines()
+
+    return lines + [
+        line.to_line() if isinstance(line, CompactLine) else line for line in req.lines
+    ]
+
+
+def _save_canvas_delta(
+    canvas: CanvasState, req: DrawDeltaRequest, new_lines: list[Line]
+) -> int:
+    if req.base_revision is None:
+        canvas.clear()
+
+    canvas.append(req.lines)
+
+    return canvas.append(new_lines)
+
+
+async def _chat_turn(websocket: WebSocket, user: User, prompt: str) -> None:
+    """
+    Answers one prompt and stores the exchange.
+
+    The turn can be cancelled at any point. It then still stores the prompt
+    with the text generated so far as a partial answer and sends
+    `[STOPPED]`. Each turn opens its own database sessions, so a cancelled
+    turn cannot leave a shared session in a broken state.
+    """
+    visit = None
+    full_response = ""
+    partial = False
+
+    try:
+        async with db.async_session() as session:
+            visit = await visit_manager.get_ws_visit(session, user)
+
+            await message_writer.wait_for(user.id)
+
+            input_items = await generate_input_items(
+                session,
+                user.id,
+                visit.session_id,
+                query=prompt,
+                reserved_tokens=message_tokens(prompt),
+            )
+
+        input_items.append({"role": "user", "type": "message", "content": prompt})
+
+        async for chunk in visit.chat(input_items):
+            await websocket.send_text(chunk)
+            full_response += chunk
+    except asyncio.CancelledError:
+        partial = True
+
+    if visit is None:
+        # cancelled while looking the visit up
+        async with db.async_session() as session:
+            visit = await visit_manager.get_ws_visit(session, user)
+
+    user_message = Message(
+        user_id=user.id,
+        content=prompt,
+        role="user",
+        session_id=visit.session_id,
+        token_count=message_tokens(prompt),
+    )
+
+    assistant_message = Message(
+        user_id=user.id,
+        content=full_response,
+        role="assistant",
+        session_id=visit.session_id,
+        token_count=message_tokens(full_response),
+        partial=partial,
+    )
+
+    message_writer.add([user_message, assistant_message])
+
+    await websocket.send_text("[STOPPED]" if partial else "[END]")
+
+
 @router.websocket(
     path="/ws",
     name="Chat WebSocket",
 )
 async def handle_websocket(
     websocket: WebSocket,
-    session: SessionDep,
     user: User = Depends(get_ws_user),
 ):
     """
     WebSocket endpoint for real-time chat.
 
     - Accepts a prompt from the user.
-    - Streams the assistant's response in chunks.
+    - Streams the assistant's response in chunks, followed by `[END]`.
+    - Accepts `[STOP]` while a response streams, which stops generating it.
+      The response so far is stored as partial and `[STOPPED]` is sent
+      instead of `[END]`.
+    - Prompts sent while a response streams are answered in turn, or replace
+      it when `settings.chat_prompt_policy` is "supersede".
     - Stores both user and assistant messages in the database.
     - Closes the connection on error.
     """
-    is_closed = False
+    user_id = str(user.id)
+    prompts: asyncio.Queue[str] = asyncio.Queue()
+    current_turn: asyncio.Task | None = None
+
+    def stop_current_turn():
+        if current_turn is not None and not current_turn.done():
+            current_turn.cancel()
+
+    async def read_prompts():
+        while True:
+            prompt = await websocket.receive_text()
+
+            if prompt == STOP_MESSAGE:
+                stop_current_turn()
+                continue
+
+            if settings.chat_prompt_policy == "supersede":
+                while not prompts.empty():
+                    prompts.get_nowait()
+
+                stop_current_turn()
+
+            prompts.put_nowait(prompt)
+
+    async def answer_prompts():
+        nonlocal current_turn
+
+        while True:
+            prompt = await prompts.get()
+            current_turn = asyncio.create_task(_chat_turn(websocket, user, prompt))
+
+            try:
+                await asyncio.wait({current_turn})
+            finally:
+                # on disconnect the answer is stopped, but still stored
+                if not current_turn.done():
+                    current_turn.cancel()
+                    await asyncio.wait({current_turn})
+
+            if not current_turn.cancelled():
+                current_turn.result()
 
     try:
         token = websocket.headers.get("sec-websocket-protocol")
         await websocket.accept(subprotocol=token)
 
-        socket_manager.add(str(user.id), websocket)
+        socket_manager.add(user_id, websocket)
 
-        while True:
-            try:
-                prompt = await websocket.receive_text()
-                visit = await visit_manager.get_ws_visit(session, user)
-
-                input_items = generate_input_items(session, user.id)
-
-                input_items.append(
-                    {"role": "user", "type": "message", "content": prompt}
-                )
-
-                full_response = ""
-
-                async for chunk in visit.chat(input_items):
-                    await websocket.send_text(chunk)
-                    full_response += chunk
-
-                await websocket.send_text("[END]")
-
-                user_message = Message(
-                    user_id=user.id,
-                    content=prompt,
-                    role="user",
-                    user=user,
-                    session_id=visit.session_id,
-                )
-
-                assistant_message = Message(
-                    user_id=user.id,
-                    content=full_response,
-                    role="assistant",
-                    user=user,
-                    session_id=visit.session_id,
-                )
-
-                session.add_all([user_message, assistant_message])
-                session.commit()
-                session.refresh(user_message)
-                session.refresh(assistant_message)
-            except Exception as inner_e:
-                session.rollback()
-                if not is_closed:
-                    await websocket.close(code=1011, reason=f"Error: {inner_e}")
-                    is_closed = True
-                break
-    except Exception as outer_e:
-        session.rollback()
-
-        if not is_closed:
-            try:
-                await websocket.close(code=1011, reason=f"Fatal Error: {outer_e}")
-            except RuntimeError:
-                pass
+        tasks = {
+            asyncio.create_task(read_prompts()),
+            asyncio.create_task(answer_prompts()),
+        }
+
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        for task in done:
+            error = None if task.cancelled() else task.exception()
+
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                raise error
+    except Exception as e:
+        try:
+            await websocket.close(code=1011, reason=f"Error: {e}")
+        except RuntimeError:
+            pass
     finally:
-        socket_manager.remove(str(user.id))
+        socket_manager.remove(user_id)
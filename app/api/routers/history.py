@@ -1,16 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from fastapi.responses import FileResponse, JSONResponse
-from sqlmodel import select
-from app.core.database import SessionDep
-from app.models.db import Session, User, Message
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import (
+    FileResponse,
+    RedirectResponse,
+    StreamingResponse,
+)
+from sqlmodel import delete, desc, select, tuple_
+from app.core.database import AsyncSessionDep
+from app.models.db import DeletionJob, Session, User, Message, MessageEmbedding
+from app.models.schemas import DeletionJobReturn, HistoryPage
 from ..dependencies import get_current_user
-import os, shutil
 from app.core.config import get_settings
+from app.core.image_processor import image_processor
+from app.core.vector_index import vector_index
+from app.core.storage import Storage, derivative_storage, upload_storage
+from app.core.visit_manager import visit_manager
+from app.services.deletion_queue import deletion_queue
+from app.services.message_writer import message_writer
+from app.utils.image import MIME_TYPES, thumbnail_width
+from datetime import datetime
 from pathlib import Path
+from PIL import UnidentifiedImageError
+from uuid import UUID
+import asyncio, base64, re
+import orjson
 
 settings = get_settings()
 
+CONTENT_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
 router = APIRouter(
     prefix="/history",
     tags=["history"],
@@ -20,27 +37,89 @@ router = APIRouter(
 @router.get(
     path="/",
     summary="Get user chat history",
-    response_model=List[Message],
-    response_description="A list of the latest chat messages for the authenticated user.",
+    response_model=HistoryPage,
+    response_description="A page of chat messages for the authenticated user, newest first.",
+    responses={
+        400: {"description": "Invalid cursor"},
+    },
 )
 async def get_chat_history(
-    session: SessionDep,
+    session: AsyncSessionDep,
     user: User = Depends(get_current_user),
-    offset: int | None = Query(default=0, ge=0, description="offset history messages"),
+    cursor: str | None = Query(
+        default=None, description="`next_cursor` of the previous page"
+    ),
+    limit: int = Query(
+        default=settings.history_page_size,
+        ge=1,
+        le=settings.history_max_page_size,
+        description="Number of messages per page",
+    ),
 ):
     """
-    Retrieve the latest 10 chat messages for the authenticated user with optional offset.
+    Retrieve the chat messages of the authenticated user, newest first, one
+    page at a time.
 
-    - **session**: Database session dependency.
-    - **user**: The currently authenticated user (injected via dependency).
+    - **cursor**: Omit for the latest messages, or pass the `next_cursor` of
+      the previous page to continue from there.
+    - **limit**: Number of messages per page.
 
-    Returns a list of `Message` objects representing the user's chat history, ordered by insertion.
+    Returns the `Message` objects of the page and the cursor for the next page.
     """
-    logs = session.exec(
-        select(Message).where(Message.user_id == user.id).offset(offset).limit(10)
+    await message_writer.wait_for(user.id)
+
+    statement = select(Message).where(Message.user_id == user.id)
+
+    if cursor is not None:
+        timestamp, id = _decode_cursor(cursor)
+        statement = statement.where(
+            tuple_(Message.timestamp, Message.id) < tuple_(timestamp, id)
+        )
+
+    messages = (
+        await session.exec(
+            statement.order_by(desc(Message.timestamp), desc(Message.id)).limit(
+                limit + 1
+            )
+        )
     ).all()
 
-    return logs
+    next_cursor = None
+
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_cursor = _encode_cursor(messages[-1])
+
+    return HistoryPage(messages=messages, next_cursor=next_cursor)
+
+
+def _encode_cursor(message: Message) -> str:
+    payload = orjson.dumps([message.timestamp.isoformat(), message.id.hex])
+
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, id = orjson.loads(payload)
+
+        return datetime.fromisoformat(timestamp), UUID(hex=id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip().removeprefix("W/")
+
+        if candidate == "*" or candidate == etag:
+            return True
+
+    return False
 
 
 @router.get(
@@ -48,53 +127,147 @@ async def get_chat_history(
     summary="Fetch uploaded image by filename",
     response_class=FileResponse,
     response_description="Returns the requested image file if it exists.",
+    responses={
+        304: {"description": "Image not modified"},
+    },
 )
 async def get_uploaded_image(
     filename: str,
-) -> FileResponse:
+    request: Request,
+    w: int | None = Query(
+        default=None, gt=0, description="Return a thumbnail at most this wide"
+    ),
+) -> Response:
+    """
+    Serve an uploaded image, or a cached thumbnail of it when `w` is given.
 
-    uploads_dir = Path(settings.uploads_dir).resolve()
-    requested_path = (uploads_dir / filename).resolve()
+    Content-addressed images never change, so they are served with a strong
+    ETag and long-lived immutable cache headers.
+    """
 
-    if not str(requested_path).startswith(str(uploads_dir)):
+    try:
+        filename = upload_storage.normalize_key(filename)
+    except ValueError:
         raise HTTPException(status_code=400, detail="Invalid filename path")
 
-    if not requested_path.is_file():
+    if not await asyncio.to_thread(upload_storage.exists, filename):
         raise HTTPException(status_code=404, detail="Image not found")
 
-    return FileResponse(str(requested_path), media_type="image/png")
+    path = Path(filename)
+    etag = path.name
+    cache_control = (
+        "public, max-age=31536000, immutable"
+        if CONTENT_HASH_PATTERN.match(path.stem)
+        else "no-cache"
+    )
+
+    if w is not None:
+        w = thumbnail_width(w)
+        etag = f"{etag}-w{w}"
+
+    headers = {"ETag": f'"{etag}"', "Cache-Control": cache_control}
+
+    if _etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    if w is None:
+        storage: Storage = upload_storage
+        key = filename
+        media_type = MIME_TYPES.get(path.suffix.lower(), "image/png")
+    else:
+        try:
+            key = await image_processor.thumbnail(filename, w)
+        except (UnidentifiedImageError, ValueError):
+            # storage and disk errors are left to surface as server errors
+            raise HTTPException(status_code=400, detail="Invalid image file")
+
+        storage = derivative_storage
+        media_type = "image/webp"
+
+    return _serve_object(storage, key, media_type, headers)
+
+
+def _serve_object(
+    storage: Storage, key: str, media_type: str, headers: dict[str, str]
+) -> Response:
+    """
+    Serve a stored object without passing its bytes through Python when the
+    backend allows it: a redirect to a presigned URL, or a file from disk.
+    """
+    presigned_url = storage.presigned_url(key)
+
+    if presigned_url:
+        # the presigned URL expires, so only the redirect's target is long-lived
+        redirect_headers = {**headers, "Cache-Control": "private, max-age=300"}
+        return RedirectResponse(
+            presigned_url, status_code=307, headers=redirect_headers
+        )
+
+    file_path = storage.file_path(key)
+
+    if file_path:
+        return FileResponse(file_path, media_type=media_type, headers=headers)
+
+    return StreamingResponse(
+        storage.iter_chunks(key), media_type=media_type, headers=headers
+    )
 
 
 @router.delete(
     path="/reset",
     summary="Reset user chat history, visits and uploaded images",
-    response_class=JSONResponse,
-    response_description="Confirmation message after deletion.",
+    response_model=DeletionJobReturn,
+    status_code=202,
+    response_description="The job deleting the uploaded images in the background.",
 )
-async def reset_history(session: SessionDep, user: User = Depends(get_current_user)):
-    uploads_dir = settings.uploads_dir
-    user_uploads_dir = f"{uploads_dir}/{user.id}"
+async def reset_history(
+    session: AsyncSessionDep, user: User = Depends(get_current_user)
+):
+    """
+    Delete the chat history and visits of the authenticated user right away,
+    and queue the removal of their uploaded images.
 
+    Returns the deletion job, whose status can be followed at
+    `/history/reset/{job_id}`.
+    """
     try:
-        if os.path.exists(user_uploads_dir):
-            shutil.rmtree(user_uploads_dir)
+        await message_writer.wait_for(user.id)
 
-        all_messages = session.exec(
-            select(Message).where(Message.user_id == user.id)
-        ).all()
+        job = DeletionJob(user_id=user.id, prefix=str(user.id))
 
-        all_visits = session.exec(
-            select(Session).where(Session.user_id == user.id)
-        ).all()
+        await session.exec(
+            delete(MessageEmbedding).where(MessageEmbedding.user_id == user.id)
+        )
+        await session.exec(delete(Message).where(Message.user_id == user.id))
+        await session.exec(delete(Session).where(Session.user_id == user.id))
+        session.add(job)
 
-        for message in all_messages:
-            session.delete(message)  # workaround
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        raise HTTPException(status_code=500, detail=f"Error deleting data: {e}")
 
-        for visit in all_visits:
-            session.delete(visit)  # workaround
+    vector_index.discard(user.id)
+    visit_manager.discard(user.id)
+    deletion_queue.submit(job)
 
-        session.commit()
+    return DeletionJobReturn(job_id=str(job.id), status=job.status)
 
-        return JSONResponse({"detail": "Successfully deleted chat history"})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error deleting data: {e}")
+
+@router.get(
+    path="/reset/{job_id}",
+    summary="Get the status of a history reset",
+    response_model=DeletionJobReturn,
+    responses={
+        404: {"description": "Deletion job not found"},
+    },
+)
+async def get_reset_status(
+    job_id: UUID, session: AsyncSessionDep, user: User = Depends(get_current_user)
+):
+    job = await session.get(DeletionJob, job_id)
+
+    if job is None or job.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Deletion job not found.")
+
+    return DeletionJobReturn(job_id=str(job.id), status=job.status)
@@ -0,0 +1,111 @@
+import asyncio
+from array import array
+from collections import OrderedDict
+from uuid import UUID
+import numpy as np
+from app.core.config import get_settings
+from app.models.schemas import CompactLine, Line
+
+settings = get_settings()
+
+
+class CanvasState:
+    """
+    Array-backed canvas of a single visit.
+
+    Points of all lines are kept in one flat float64 buffer, with per-line
+    offsets and attributes in parallel arrays. The revision is the number of
+    lines on the canvas, so a client that knows how many lines it has sent
+    knows its revision.
+    """
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        self._points = array("d")
+        self._offsets = array("q", [0])
+        self._sizes = array("i")
+        self._opacities = array("f")
+        self._timestamps = array("q")
+        self._types = array("i")
+        self._colors: list[str] = []
+
+    @property
+    def revision(self) -> int:
+        return len(self._colors)
+
+    @property
+    def point_count(self) -> int:
+        return len(self._points) // 2
+
+    def append(self, lines: list[Line | CompactLine]) -> int:
+        for line in lines:
+            if isinstance(line, CompactLine):
+                self._points.frombytes(
+                    line.points_array.astype(np.float64, copy=False).tobytes()
+                )
+            else:
+                self._points.extend(line.points)
+
+            self._offsets.append(len(self._points))
+            self._sizes.append(line.size)
+            self._opacities.append(line.opacity)
+            self._timestamps.append(line.timestamp)
+            self._types.append(line.type)
+            self._colors.append(line.color)
+
+        return self.revision
+
+    def points(self) -> np.ndarray:
+        return np.frombuffer(self._points, dtype=np.float64)
+
+    def lines(self) -> list[Line]:
+        """
+        Rebuilds the canvas as Line objects, without validating them again.
+        """
+        points = self.points().tolist()
+        offsets = self._offsets
+
+        return [
+            Line.model_construct(
+                points=points[offsets[index] : offsets[index + 1]],
+                color=self._colors[index],
+                size=self._sizes[index],
+                opacity=self._opacities[index],
+                timestamp=self._timestamps[index],
+                type=self._types[index],
+            )
+            for index in range(self.revision)
+        ]
+
+
+class CanvasStore:
+    """
+    Keeps the canvas state of the most recently drawn-on visits in memory.
+    """
+
+    def __init__(self, max_sessions: int):
+        self.max_sessions = max_sessions
+        self._states: OrderedDict[UUID, CanvasState] = OrderedDict()
+
+    def get(self, session_id: UUID) -> CanvasState:
+        state = self._states.get(session_id)
+
+        if state is None:
+            state = CanvasState()
+            self._states[session_id] = state
+
+            while len(self._states) > self.max_sessions:
+                self._states.popitem(last=False)
+        else:
+            self._states.move_to_end(session_id)
+
+        return state
+
+    def discard(self, session_id: UUID) -> None:
+        self._states.pop(session_id, None)
+
+
+canvas_store = CanvasStore(max_sessions=settings.canvas_store_max_sessions)
@@ -17,6 +17,15 @@ class BaseConfig(BaseSettings):
 
     # constants
     uploads_dir: str = Field(default="uploads")
+    derivatives_dir: str = Field(default="cache/derivatives")
+    storage_backend: str = Field(default="local")
+    s3_bucket: str = Field(default="")
+    s3_endpoint_url: str | None = Field(default=None)
+    s3_region: str | None = Field(default=None)
+    s3_access_key_id: str | None = Field(default=None)
+    s3_secret_access_key: str | None = Field(default=None)
+    s3_presign: bool = Field(default=True)
+    s3_presign_expiry: int = Field(default=3600)
     pwd_context: CryptContext = Field(
         default=CryptContext(schemes=["bcrypt"], deprecated="auto")
     )
@@ -24,6 +33,68 @@ class BaseConfig(BaseSettings):
     access_token_expire_minutes: int = Field(default=30)
     refresh_token_expire_days: int = Field(default=1)
 
+    # database
+    database_url: str = Field(default="sqlite:///database.db")
+    database_async: bool = Field(default=True)
+    database_profile: str = Field(default="default")
+    database_pool_size: int = Field(default=10)
+    database_max_overflow: int = Field(default=20)
+    database_pool_timeout: int = Field(default=30)
+    database_pool_recycle: int = Field(default=1800)
+    sqlite_busy_timeout_ms: int = Field(default=5000)
+    sqlite_mmap_size: int = Field(default=256 * 1024 * 1024)
+    sqlite_cache_size_kb: int = Field(default=64 * 1024)
+
+    # history
+    history_page_size: int = Field(default=10)
+    history_max_page_size: int = Field(default=100)
+    deletion_max_attempts: int = Field(default=3)
+    visit_cache_max_users: int = Field(default=10000)
+
+    # chat context
+    context_scope: str = Field(default="user")
+    context_recent_messages: int = Field(default=5)
+    context_token_budget: int = Field(default=8000)
+    context_max_messages: int = Field(default=50)
+    tokenizer_model: str = Field(default="gpt-4.1")
+    rag_top_k: int = Field(default=3)
+    rag_min_score: float = Field(default=0.1)
+    embedding_provider: str = Field(default="local")
+    embedding_model: str = Field(default="text-embedding-3-small")
+    embedding_dimensions: int = Field(default=256)
+    vector_index_max_users: int = Field(default=1000)
+    summary_trigger_tokens: int = Field(default=2000)
+
+    # chat streaming
+    stream_flush_interval_ms: int = Field(default=40)
+    stream_flush_bytes: int = Field(default=256)
+    stream_pacing_ms: int = Field(default=0)
+    chat_prompt_policy: str = Field(default="queue")
+    message_flush_batch_size: int = Field(default=100)
+    message_flush_interval_ms: int = Field(default=50)
+
+    # drawing
+    draw_input_mode: str = Field(default="json")
+    canvas_raster_max_side: int = Field(default=1024)
+    canvas_store_max_sessions: int = Field(default=1000)
+    stroke_tolerance: float = Field(default=1.0)
+    stroke_precision: int = Field(default=0)
+    draw_debug_spool: bool = Field(default=False)
+    draw_spool_dir: str = Field(default="tmp/draw")
+    draw_spool_max_bytes: int = Field(default=50 * 1024 * 1024)
+
+    # images
+    max_upload_bytes: int = Field(default=20 * 1024 * 1024)
+    upload_chunk_size: int = Field(default=1024 * 1024)
+    image_cache_max_bytes: int = Field(default=64 * 1024 * 1024)
+    image_max_side: int = Field(default=2048)
+    model_image_format: str | None = Field(default="webp")
+    model_image_quality: int = Field(default=85)
+    phash_max_distance: int = Field(default=5)
+    thumbnail_widths: list[int] = Field(default=[64, 128, 256, 512, 1024])
+    image_workers: int = Field(default=4)
+    image_queue_warn_depth: int = Field(default=16)
+
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
     @classmethod
@@ -1,27 +1,256 @@
+import asyncio
 from app.models import db as db_models
-from typing import Annotated
+from typing import Annotated, AsyncIterator
 from fastapi import Depends
+from sqlalchemy import event, inspect, make_url, text
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.core.config import get_settings
+
+settings = get_settings()
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def async_url(url: str) -> str:
+    """
+    Returns the database URL with the async driver for its backend, unless it
+    already names a driver.
+    """
+    parsed = make_url(url)
+
+    if "+" in parsed.drivername or parsed.drivername not in ASYNC_DRIVERS:
+        return url
+
+    return parsed.set(drivername=ASYNC_DRIVERS[parsed.drivername]).render_as_string(
+        hide_password=False
+    )
+
+
+class ThreadedSession:
+    """
+    Gives a sync `Session` the interface of an `AsyncSession`, running its
+    database work in a worker thread so the event loop is never blocked.
+    """
+
+    def __init__(self, session: Session):
+        self.sync_session = session
+
+    async def __aenter__(self) -> "ThreadedSession":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def add(self, instance) -> None:
+        self.sync_session.add(instance)
+
+    def add_all(self, instances) -> None:
+        self.sync_session.add_all(instances)
+
+    async def exec(self, statement, **kwargs):
+        # fetch the rows in the worker thread too, like AsyncSession does
+        kwargs["execution_options"] = {
+            **kwargs.get("execution_options", {}),
+            "prebuffer_rows": True,
+        }
+        return await asyncio.to_thread(self.sync_session.exec, statement, **kwargs)
+
+    async def execute(self, statement, *args, **kwargs):
+        return await asyncio.to_thread(
+            self.sync_session.execute, statement, *args, **kwargs
+        )
+
+    async def get(self, entity, ident, **kwargs):
+        return await asyncio.to_thread(self.sync_session.get, entity, ident, **kwargs)
+
+    async def merge(self, instance):
+        return await asyncio.to_thread(self.sync_session.merge, instance)
+
+    async def delete(self, instance) -> None:
+        await asyncio.to_thread(self.sync_session.delete, instance)
+
+    async def refresh(self, instance) -> None:
+        await asyncio.to_thread(self.sync_session.refresh, instance)
+
+    async def flush(self) -> None:
+        await asyncio.to_thread(self.sync_session.flush)
+
+    async def commit(self) -> None:
+        await asyncio.to_thread(self.sync_session.commit)
+
+    async def rollback(self) -> None:
+        await asyncio.to_thread(self.sync_session.rollback)
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self.sync_session.close)
 
 
 class Database:
-    def __init__(self, sqlite_file_name="database.db"):
-        self._sqlite_url = f"sqlite:///{sqlite_file_name}"
+    """
+    Holds the engines for `settings.database_url`.
+
+    Schema setup always runs on a sync engine. Requests get an
+    `AsyncSession` on an async engine (aiosqlite, asyncpg) when
+    `settings.database_async` is set, and otherwise a `ThreadedSession` that
+    runs the sync engine in worker threads.
+
+    The "production" profile tunes SQLite for many concurrent short
+    sessions: WAL lets readers run alongside the writer, and connections
+    wait for the write lock instead of failing. Other databases, like
+    PostgreSQL, always get the configured pool sizing.
+    """
+
+    def __init__(
+        self,
+        url: str = settings.database_url,
+        use_async: bool = settings.database_async,
+        profile: str = settings.database_profile,
+    ):
+        self._url = url
+        self._is_sqlite = make_url(url).get_backend_name() == "sqlite"
+        self._profile = profile
+
+        connect_args = {"check_same_thread": False} if self._is_sqlite else {}
+        options = self._engine_options()
 
-        connect_args = {"check_same_thread": False}
+        self._engine = create_engine(self._url, connect_args=connect_args, **options)
+        self._async_engine = (
+            create_async_engine(async_url(self._url), **options) if use_async else None
+        )
 
-        self._engine = create_engine(self._sqlite_url, connect_args=connect_args)
+        if self._is_sqlite and profile == "production":
+            event.listen(self._engine, "connect", self._set_sqlite_pragmas)
+
+            if self._async_engine is not None:
+                event.listen(
+                    self._async_engine.sync_engine, "connect", self._set_sqlite_pragmas
+                )
 
         self._create_db_and_tables()
 
+    def _engine_options(self) -> dict:
+        if self._is_sqlite and self._profile != "production":
+            return {}
+
+        options = {
+            "pool_size": settings.database_pool_size,
+            "max_overflow": settings.database_max_overflow,
+            "pool_timeout": settings.database_pool_timeout,
+        }
+
+        if not self._is_sqlite:
+            # server connections can be dropped behind the pool's back
+            options["pool_recycle"] = settings.database_pool_recycle
+            options["pool_pre_ping"] = True
+
+        return options
+
+    def _set_sqlite_pragmas(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+
+        for pragma in (
+            "journal_mode=WAL",
+            "synchronous=NORMAL",
+            f"busy_timeout={settings.sqlite_busy_timeout_ms}",
+            f"mmap_size={settings.sqlite_mmap_size}",
+            # negative sizes are in KiB rather than pages
+            f"cache_size=-{settings.sqlite_cache_size_kb}",
+        ):
+            cursor.execute(f"PRAGMA {pragma}")
+
+        cursor.close()
+
     def _create_db_and_tables(self):
         SQLModel.metadata.create_all(self._engine)
+        self._migrate()
+
+    def _migrate(self):
+        """
+        Brings tables created by an older version of the models up to date.
+
+        `create_all` only creates missing tables, so columns and indexes added
+        to a model later are added here, and indexes a model no longer
+        declares are dropped. Only nullable columns or columns with a server
+        default can be added to a table that already holds rows.
+        """
+        inspector = inspect(self._engine)
+        preparer = self._engine.dialect.identifier_preparer
+
+        with self._engine.begin() as connection:
+            for table in SQLModel.metadata.sorted_tables:
+                existing_columns = {
+                    column["name"] for column in inspector.get_columns(table.name)
+                }
+
+                for column in table.columns:
+                    if column.name in existing_columns:
+                        continue
+
+                    column_type = column.type.compile(dialect=self._engine.dialect)
+                    ddl = (
+                        f"ALTER TABLE {preparer.quote(table.name)} "
+                        f"ADD COLUMN {preparer.quote(column.name)} {column_type}"
+                    )
+
+                    if column.server_default is not None:
+                        default = column.server_default.arg
+
+                        if isinstance(default, str):
+                            default = "'" + default.replace("'", "''") + "'"
+
+                        ddl += f" DEFAULT {default}"
+                    elif not column.nullable:
+                        raise RuntimeError(
+                            f"Cannot add non-nullable column {table.name}.{column.name}"
+                        )
+
+                    connection.execute(text(ddl))
+
+                for index in table.indexes:
+                    index.create(connection, checkfirst=True)
+
+                model_indexes = {index.name for index in table.indexes}
+
+                for index in inspector.get_indexes(table.name):
+                    # only indexes named like the ones the models declare
+                    if index["name"].startswith("ix_") and (
+                        index["name"] not in model_indexes
+                    ):
+                        connection.execute(
+                            text(f"DROP INDEX {preparer.quote(index['name'])}")
+                        )
 
     def get_session(self):
         with Session(self._engine) as session:
             yield session
 
+    def async_session(self) -> AsyncSession:
+        """
+        Opens a session for async code, in requests as well as background
+        tasks. Loaded objects stay usable after a commit.
+        """
+        if self._async_engine is None:
+            return ThreadedSession(Session(self._engine, expire_on_commit=False))
+
+        return AsyncSession(self._async_engine, expire_on_commit=False)
+
+    async def get_async_session(self) -> AsyncIterator[AsyncSession]:
+        async with self.async_session() as session:
+            yield session
+
+    async def dispose(self) -> None:
+        if self._async_engine is not None:
+            await self._async_engine.dispose()
+
+        self._engine.dispose()
+
 
 db = Database()
 
 SessionDep = Annotated[Session, Depends(db.get_session)]
+AsyncSessionDep = Annotated[AsyncSession, Depends(db.get_async_session)]
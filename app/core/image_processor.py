@@ -0,0 +1,116 @@
+import asyncio, logging, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, TypeVar
+from app.core.config import get_settings
+from app.utils.image import (
+    StoredImage,
+    create_thumbnail,
+    data_url_cache,
+    data_url_key,
+    encode_data_url,
+    save_upload_stream,
+)
+
+settings = get_settings()
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class ImageProcessor:
+    """
+    Runs image decoding, resizing, encoding and file I/O on a bounded thread pool,
+    so that image work never blocks the event loop.
+    """
+
+    def __init__(self, max_workers: int, queue_warn_depth: int):
+        self.max_workers = max_workers
+        self.queue_warn_depth = queue_warn_depth
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="image"
+        )
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._failed = 0
+        self._peak_queued = 0
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        with self._lock:
+            self._queued += 1
+            self._peak_queued = max(self._peak_queued, self._queued)
+            queued = self._queued
+
+        if queued >= self.queue_warn_depth:
+            logger.warning(
+                "Image pool saturated: %d jobs queued, %d workers busy",
+                queued,
+                self._active,
+            )
+
+        def job() -> T:
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+
+            succeeded = False
+
+            try:
+                result = fn(*args, **kwargs)
+                succeeded = True
+                return result
+            finally:
+                with self._lock:
+                    self._active -= 1
+
+                    if succeeded:
+                        self._completed += 1
+                    else:
+                        self._failed += 1
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, job)
+
+    async def save_upload(self, source: BinaryIO, user_id: str) -> StoredImage:
+        return await self.run(save_upload_stream, source, user_id)
+
+    async def data_url(self, filename: str) -> str:
+        """
+        Returns the model-ready data-URL for a stored upload.
+
+        Encodings are cached by content hash (the filename stem), so an image
+        that appears in several chat turns is only read and encoded once.
+        """
+        key = data_url_key(filename)
+        data_url = data_url_cache.get(key)
+
+        if data_url is None:
+            data_url = await self.run(encode_data_url, filename)
+            data_url_cache.put(key, data_url)
+
+        return data_url
+
+    async def thumbnail(self, filename: str, width: int) -> str:
+        return await self.run(create_thumbnail, filename, width)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "queued": self._queued,
+                "active": self._active,
+                "completed": self._completed,
+                "failed": self._failed,
+                "peak_queued": self._peak_queued,
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+image_processor = ImageProcessor(
+    max_workers=settings.image_workers,
+    queue_warn_depth=settings.image_queue_warn_depth,
+)
@@ -0,0 +1,274 @@
+import os, posixpath, shutil, tempfile
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator
+from app.core.config import get_settings
+
+settings = get_settings()
+
+
+class Storage(ABC):
+    """
+    Stores objects such as uploads and their derivatives under string keys
+    like `<user_id>/<hash>.png`.
+    """
+
+    def normalize_key(self, key: str) -> str:
+        """
+        Validates a key and returns it in canonical form.
+
+        Raises ValueError for keys that would escape the storage root.
+        """
+        normalized = posixpath.normpath(key.replace("\\", "/"))
+
+        if normalized.startswith(("/", "..")) or normalized in (".", ""):
+            raise ValueError(f"Invalid storage key: {key}")
+
+        return normalized
+
+    @abstractmethod
+    def exists(self, key: str) -> bool: ...
+
+    @abstractmethod
+    def read(self, key: str) -> bytes: ...
+
+    @abstractmethod
+    def iter_chunks(self, key: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """
+        Streams an object without loading it into memory as a whole.
+        """
+
+    @abstractmethod
+    def write(
+        self, key: str, data: bytes | BinaryIO, content_type: str | None = None
+    ) -> None:
+        """
+        Writes an object. File objects are streamed rather than read at once.
+        """
+
+    @abstractmethod
+    def delete_prefix(self, prefix: str) -> None:
+        """
+        Deletes every object whose key starts with `prefix`.
+        """
+
+    @contextmanager
+    def local_path(self, key: str) -> Iterator[str]:
+        """
+        Yields a filesystem path holding the object, downloading it to a
+        temporary file if the backend is not on local disk.
+        """
+        fd, temp_path = tempfile.mkstemp()
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in self.iter_chunks(key):
+                    f.write(chunk)
+
+            yield temp_path
+        finally:
+            os.remove(temp_path)
+
+    def file_path(self, key: str) -> str | None:
+        """
+        Returns the path of the object on local disk, if the backend has one.
+        """
+        return None
+
+    def presigned_url(self, key: str) -> str | None:
+        """
+        Returns a URL clients can fetch the object from directly, if supported.
+        """
+        return None
+
+
+class LocalStorage(Storage):
+    """
+    Stores objects as files below a root directory.
+
+    Writes go to a temporary file that is moved into place, so readers never
+    see a partial object and concurrent writes of a key do not collide.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        root = self.root.resolve()
+        path = (root / self.normalize_key(key)).resolve()
+
+        if not path.is_relative_to(root):
+            raise ValueError(f"Invalid storage key: {key}")
+
+        return path
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+    def read(self, key: str) -> bytes:
+        return self._path(key).read_bytes()
+
+    def iter_chunks(self, key: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        with open(self._path(key), "rb") as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+
+    def write(
+        self, key: str, data: bytes | BinaryIO, content_type: str | None = None
+    ) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # a unique temp file per write, as threads may write the same key at once
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if isinstance(data, bytes):
+                    f.write(data)
+                else:
+                    shutil.copyfileobj(data, f)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        try:
+            os.replace(temp_path, path)
+        except OSError:
+            os.remove(temp_path)
+
+            # keys are content-addressed, so a concurrent write stored the same bytes
+            if not path.is_file():
+                raise
+
+    def delete_prefix(self, prefix: str) -> None:
+        path = self._path(prefix)
+
+        if path.is_dir():
+            shutil.rmtree(path)
+        elif path.is_file():
+            path.unlink()
+
+    @contextmanager
+    def local_path(self, key: str) -> Iterator[str]:
+        yield str(self._path(key))
+
+    def file_path(self, key: str) -> str | None:
+        return str(self._path(key))
+
+
+class S3Storage(Storage):
+    """
+    Stores objects in an S3-compatible bucket below a key prefix.
+
+    Set `endpoint_url` to point at MinIO, moto or any other S3-compatible
+    server instead of AWS.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: str | None = None,
+        region: str | None = None,
+        access_key_id: str | None = None,
+        secret_access_key: str | None = None,
+        presign: bool = True,
+        presign_expiry: int = 3600,
+    ):
+        import boto3
+        from botocore.exceptions import ClientError
+
+        self._client_error = ClientError
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.presign = presign
+        self.presign_expiry = presign_expiry
+        self._client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+        )
+
+    def _key(self, key: str) -> str:
+        key = self.normalize_key(key)
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def exists(self, key: str) -> bool:
+        try:
+            self._client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return False
+            raise
+
+    def read(self, key: str) -> bytes:
+        response = self._client.get_object(Bucket=self.bucket, Key=self._key(key))
+        return response["Body"].read()
+
+    def iter_chunks(self, key: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        response = self._client.get_object(Bucket=self.bucket, Key=self._key(key))
+        yield from response["Body"].iter_chunks(chunk_size)
+
+    def write(
+        self, key: str, data: bytes | BinaryIO, content_type: str | None = None
+    ) -> None:
+        extra_args = {"ContentType": content_type} if content_type else {}
+
+        if isinstance(data, bytes):
+            self._client.put_object(
+                Bucket=self.bucket, Key=self._key(key), Body=data, **extra_args
+            )
+        else:
+            self._client.upload_fileobj(
+                data, self.bucket, self._key(key), ExtraArgs=extra_args
+            )
+
+    def delete_prefix(self, prefix: str) -> None:
+        paginator = self._client.get_paginator("list_objects_v2")
+        prefix = self._key(prefix).rstrip("/") + "/"
+
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            objects = [{"Key": item["Key"]} for item in page.get("Contents", [])]
+
+            if objects:
+                self._client.delete_objects(
+                    Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True}
+                )
+
+    def presigned_url(self, key: str) -> str | None:
+        if not self.presign:
+            return None
+
+        return self._client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._key(key)},
+            ExpiresIn=self.presign_expiry,
+        )
+
+
+def get_storage(root: str) -> Storage:
+    """
+    Builds the configured storage backend. `root` is the directory for local
+    storage and the key prefix for S3.
+    """
+    if settings.storage_backend == "s3":
+        return S3Storage(
+            bucket=settings.s3_bucket,
+            prefix=root,
+            endpoint_url=settings.s3_endpoint_url,
+            region=settings.s3_region,
+            access_key_id=settings.s3_access_key_id,
+            secret_access_key=settings.s3_secret_access_key,
+            presign=settings.s3_presign,
+            presign_expiry=settings.s3_presign_expiry,
+        )
+
+    return LocalStorage(root)
+
+
+upload_storage = get_storage(settings.uploads_dir)
+derivative_storage = get_storage(settings.derivatives_dir)
@@ -0,0 +1,263 @@
+import asyncio, logging
+from collections import OrderedDict
+from uuid import UUID
+import numpy as np
+from sqlmodel import select
+from app.core.config import get_settings
+from app.core.database import db
+from app.models.db import Message, MessageEmbedding
+from app.services.embeddings import EmbeddingProvider, get_embedding_provider
+
+settings = get_settings()
+
+logger = logging.getLogger(__name__)
+
+
+class UserVectors:
+    """
+    Embeddings of one user's messages as rows of a single float32 matrix.
+    """
+
+    def __init__(self, dimensions: int):
+        self.ids: list[UUID] = []
+        self._positions: dict[UUID, int] = {}
+        self._matrix = np.empty((16, dimensions), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._matrix[: len(self.ids)]
+
+    def positions(self, ids: set[UUID]) -> list[int]:
+        return [self._positions[id] for id in ids if id in self._positions]
+
+    def add(self, ids: list[UUID], vectors: np.ndarray) -> None:
+        for id, vector in zip(ids, vectors):
+            if id in self._positions:
+                self._matrix[self._positions[id]] = vector
+                continue
+
+            if len(self.ids) == len(self._matrix):
+                grown = np.empty(
+                    (len(self._matrix) * 2, self._matrix.shape[1]), dtype=np.float32
+                )
+                grown[: len(self.ids)] = self._matrix
+                self._matrix = grown
+
+            self._positions[id] = len(self.ids)
+            self._matrix[len(self.ids)] = vector
+            self.ids.append(id)
+
+
+class VectorIndex:
+    """
+    Per-user embedding index of chat messages for retrieval.
+
+    Embeddings are stored in the `messageembedding` table and loaded into an
+    in-memory matrix per user on first use. Messages that have no embedding
+    yet are embedded in a background task, so they become searchable shortly
+    after. New messages are added incrementally.
+
+    Loads run in their own database session, one at a time per user, so a
+    user's cold load does not hold up anyone else.
+    """
+
+    def __init__(self, provider: EmbeddingProvider, max_users: int):
+        self.provider = provider
+        self.max_users = max_users
+        self._users: OrderedDict[UUID, UserVectors] = OrderedDict()
+        self._loading: dict[UUID, asyncio.Task] = {}
+        self._backfills: dict[UUID, asyncio.Task] = {}
+        self._stopping = False
+
+    async def embed(self, messages: list[Message]) -> list[MessageEmbedding]:
+        """
+        Embeds messages, returning the rows to store for them.
+        """
+        messages = [message for message in messages if message.content]
+
+        if not messages:
+            return []
+
+        vectors = await self.provider.embed([message.content for message in messages])
+
+        return [
+            MessageEmbedding(
+                message_id=message.id,
+                user_id=message.user_id,
+                embedding=vector.tobytes(),
+            )
+            for message, vector in zip(messages, vectors)
+        ]
+
+    def remember(self, embeddings: list[MessageEmbedding]) -> None:
+        """
+        Adds stored embeddings to the in-memory index of users that are loaded.
+        """
+        for embedding in embeddings:
+            user_vectors = self._users.get(embedding.user_id)
+
+            if user_vectors is not None:
+                user_vectors.add(
+                    [embedding.message_id],
+                    np.frombuffer(embedding.embedding, np.float32)[np.newaxis],
+                )
+
+    async def add(self, messages: list[Message]) -> None:
+        """
+        Embeds and stores messages.
+        """
+        embeddings = await self.embed(messages)
+
+        async with db.async_session() as session:
+            for embedding in embeddings:
+                await session.merge(embedding)
+
+            await session.commit()
+
+        self.remember(embeddings)
+
+    async def search(
+        self,
+        user_id: UUID,
+        query: str,
+        k: int,
+        exclude: set[UUID] | None = None,
+        min_score: float = 0.0,
+    ) -> list[UUID]:
+        """
+        Returns the ids of the `k` messages most similar to `query` by cosine
+        similarity, best first, leaving out those scoring below `min_score`.
+        """
+        user_vectors = await self._load(user_id)
+
+        if k <= 0 or not len(user_vectors) or not query:
+            return []
+
+        query_vector = (await self.provider.embed([query]))[0]
+        scores = user_vectors.matrix @ query_vector
+
+        if exclude:
+            scores[user_vectors.positions(exclude)] = -np.inf
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return [user_vectors.ids[index] for index in top if scores[index] >= min_score]
+
+    def discard(self, user_id: UUID) -> None:
+        # loads and backfills under way notice they are no longer current
+        self._users.pop(user_id, None)
+        self._loading.pop(user_id, None)
+        self._backfills.pop(user_id, None)
+
+    async def shutdown(self) -> None:
+        """
+        Stops the backfills after the batch each one is writing.
+        """
+        self._stopping = True
+
+        await asyncio.gather(*self._backfills.values(), return_exceptions=True)
+
+    async def _load(self, user_id: UUID) -> UserVectors:
+        user_vectors = self._users.get(user_id)
+
+        if user_vectors is not None:
+            self._users.move_to_end(user_id)
+            return user_vectors
+
+        task = self._loading.get(user_id)
+
+        if task is None:
+            task = self._start(self._loading, user_id, self._read(user_id))
+
+        # one caller going away must not cancel the load for the others
+        return await asyncio.shield(task)
+
+    async def _read(self, user_id: UUID) -> UserVectors:
+        user_vectors = UserVectors(self.provider.dimensions)
+
+        async with db.async_session() as session:
+            rows = (
+                await session.exec(
+                    select(MessageEmbedding).where(MessageEmbedding.user_id == user_id)
+                )
+            ).all()
+            row_size = self.provider.dimensions * 4
+            valid_rows = [row for row in rows if len(row.embedding) == row_size]
+
+            if valid_rows:
+                user_vectors.add(
+                    [row.message_id for row in valid_rows],
+                    np.frombuffer(
+                        b"".join(row.embedding for row in valid_rows), np.float32
+                    ).reshape(len(valid_rows), -1),
+                )
+
+            # messages stored before retrieval existed, or embedded with
+            # different settings, are embedded in the background
+            stale_ids = [
+                row.message_id for row in rows if len(row.embedding) != row_size
+            ]
+            missing = (
+                await session.exec(
+                    select(Message)
+                    .outerjoin(
+                        MessageEmbedding, MessageEmbedding.message_id == Message.id
+                    )
+                    .where(
+                        (Message.user_id == user_id)
+                        & (
+                            (MessageEmbedding.message_id == None)
+                            | Message.id.in_(stale_ids)
+                        )
+                    )
+                )
+            ).all()
+
+        # the user's history was reset while loading
+        if self._loading.get(user_id) is not asyncio.current_task():
+            return user_vectors
+
+        self._users[user_id] = user_vectors
+
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+        if missing and user_id not in self._backfills and not self._stopping:
+            self._start(self._backfills, user_id, self._backfill(user_id, missing))
+
+        return user_vectors
+
+    def _start(self, tasks: dict[UUID, asyncio.Task], user_id: UUID, coro):
+        task = asyncio.create_task(coro)
+        tasks[user_id] = task
+
+        def forget(task: asyncio.Task) -> None:
+            if tasks.get(user_id) is task:
+                del tasks[user_id]
+
+        task.add_done_callback(forget)
+
+        return task
+
+    async def _backfill(self, user_id: UUID, messages: list[Message]) -> None:
+        try:
+            for start in range(0, len(messages), 64):
+                # stopped by shutdown, or the user's history was reset
+                if self._stopping or (
+                    self._backfills.get(user_id) is not asyncio.current_task()
+                ):
+                    return
+
+                await self.add(messages[start : start + 64])
+        except Exception:
+            logger.exception("Embedding %d stored messages failed", len(messages))
+
+
+vector_index = VectorIndex(
+    get_embedding_provider(), max_users=settings.vector_index_max_users
+)
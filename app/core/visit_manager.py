@@ -1,89 +1,141 @@
+import asyncio
+from collections import OrderedDict
 from typing import Annotated
-from uuid import uuid4
+from uuid import UUID
 from fastapi import Depends, HTTPException
 from sqlmodel import select, update
 from app.api.dependencies import get_current_user, get_ws_user
-from app.core.database import SessionDep
+from app.core.config import get_settings
+from app.core.database import AsyncSessionDep
 from app.models.db import Session, User
 from app.services.studio_visit import StudioVisit
 from datetime import datetime
 
+settings = get_settings()
+
 
 class VisitManager:
     """
     Manages Visits(sessions) for users.
+
+    The id of each user's active visit is cached in process, so resolving
+    the visit of a request is normally a dictionary lookup. The cache is
+    filled on a miss, and updated whenever this process starts or resets a
+    visit; `discard` drops a user's entry when their visits change otherwise.
+
+    The cache is per process: when another worker or node finishes a user's
+    visit, this process keeps using the old visit until the entry is evicted
+    or the process restarts. Run a single worker, or route each user to the
+    same worker, when visits are reset often.
+
+    Misses and resets are serialized per user by striped locks, so users do
+    not wait on each other's database round-trips.
     """
 
-    def reset_visit(self, session: SessionDep, user: User) -> StudioVisit:
-        if self._has_active_visit(session, user):
-            self._finish_visit(session, user)
+    def __init__(self, max_users: int, lock_stripes: int = 64):
+        self.max_users = max_users
+        self._active: OrderedDict[UUID, UUID] = OrderedDict()
+        self._locks = [asyncio.Lock() for _ in range(lock_stripes)]
+
+    async def reset_visit(self, session: AsyncSessionDep, user: User) -> StudioVisit:
+        """
+        Finishes the active visit, if any, and starts a new one in a single
+        transaction.
+        """
+        async with self._lock(user.id):
+            self.discard(user.id)
+
+            await session.exec(
+                update(Session)
+                .where((Session.user_id == user.id) & (Session.finished_at == None))
+                .values(finished_at=datetime.now())
+            )
 
-        return self._start_visit(session, user)
+            return await self._start_visit(session, user)
 
-    def get_or_start_visit(
-        self, session: SessionDep, user: User | None = Depends(get_current_user)
+    async def get_or_start_visit(
+        self, session: AsyncSessionDep, user: User | None = Depends(get_current_user)
     ):
         if not user:
             raise HTTPException(401, "Not authorized")
 
-        active_visit = self._get_visit(session, user)
+        active_visit = self._get_cached_visit(user)
+
+        if active_visit:
+            return active_visit
+
+        async with self._lock(user.id):
+            active_visit = self._get_cached_visit(user) or await self._get_visit(
+                session, user
+            )
+
+            return (
+                active_visit if active_visit else await self._start_visit(session, user)
+            )
+
+    def discard(self, user_id: UUID) -> None:
+        self._active.pop(user_id, None)
+
+    def _lock(self, user_id: UUID) -> asyncio.Lock:
+        return self._locks[user_id.int % len(self._locks)]
 
-        return active_visit if active_visit else self._start_visit(session, user)
+    def _get_cached_visit(self, user: User) -> StudioVisit | None:
+        session_id = self._active.get(user.id)
 
-    def _get_visit(
+        if session_id is None:
+            return None
+
+        self._active.move_to_end(user.id)
+
+        return StudioVisit(session_id, user)
+
+    def _cache(self, user_id: UUID, session_id: UUID) -> None:
+        self._active[user_id] = session_id
+        self._active.move_to_end(user_id)
+
+        while len(self._active) > self.max_users:
+            self._active.popitem(last=False)
+
+    async def _get_visit(
         self,
-        session: SessionDep,
+        session: AsyncSessionDep,
         user: User,
     ) -> StudioVisit | None:
-        active_session = session.exec(
-            select(Session).where(
-                (Session.user_id == user.id) & (Session.finished_at == None)
+        active_session = (
+            await session.exec(
+                select(Session).where(
+                    (Session.user_id == user.id) & (Session.finished_at == None)
+                )
             )
         ).first()
 
         if active_session:
+            self._cache(user.id, active_session.id)
             active_visit = StudioVisit(active_session.id, user)
             return active_visit
 
         return None
 
-    def _start_visit(self, session: SessionDep, user: User) -> StudioVisit:
+    async def _start_visit(self, session: AsyncSessionDep, user: User) -> StudioVisit:
         visit_db = Session(
             user_id=user.id,
         )
 
         session.add(visit_db)
-        session.commit()
-        session.refresh(visit_db)
+        await session.commit()
+
+        self._cache(user.id, visit_db.id)
 
         new_visit = StudioVisit(session_id=visit_db.id, user=user)
 
         return new_visit
 
-    def _has_active_visit(self, session: SessionDep, user: User) -> bool:
-        return bool(self._get_visit(session, user))
-
-    def _finish_visit(self, session: SessionDep, user: User) -> None:
-        visit = session.exec(
-            select(Session).where(
-                (Session.user_id == user.id) & (Session.finished_at == None)
-            )
-        ).first()
-
-        if not visit:
-            raise HTTPException(500, "No active visit found.")
-
-        visit.finished_at = datetime.now()
-        session.add(visit)
-        session.commit()
-        session.refresh(visit)
-
 
-visit_manager = VisitManager()
+visit_manager = VisitManager(max_users=settings.visit_cache_max_users)
 
 
 VisitDep = Annotated[StudioVisit, Depends(visit_manager.get_or_start_visit)]
 
 
-async def get_ws_visit(session: SessionDep, user: User = Depends(get_ws_user)):
-    return visit_manager.get_or_start_visit(session, user)
+async def get_ws_visit(session: AsyncSessionDep, user: User = Depends(get_ws_user)):
+    return await visit_manager.get_or_start_visit(session, user)
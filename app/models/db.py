@@ -1,10 +1,16 @@
 from typing import List, Optional
+from sqlalchemy import Index, text
 from sqlmodel import Field, Relationship, SQLModel
 from uuid import UUID, uuid4
 from datetime import datetime
 
 
 class Message(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_message_user_id_timestamp_id", "user_id", "timestamp", "id"),
+        Index("ix_message_session_id_timestamp", "session_id", "timestamp"),
+    )
+
     id: UUID = Field(default_factory=uuid4, primary_key=True)
     user_id: UUID = Field(foreign_key="user.id")
     session_id: UUID = Field(foreign_key="session.id")
@@ -12,6 +18,9 @@ class Message(SQLModel, table=True):
     role: str
     timestamp: datetime = Field(default_factory=datetime.now)
     image_filename: Optional[str] = Field(default=None)
+    image_phash: Optional[str] = Field(default=None)
+    token_count: Optional[int] = Field(default=None)
+    partial: bool = Field(default=False, sa_column_kwargs={"server_default": "0"})
 
     user: Optional["User"] = Relationship(back_populates="messages")
     session: Optional["Session"] = Relationship(back_populates="messages")
@@ -29,10 +38,38 @@ class User(SQLModel, table=True):
 
 
 class Session(SQLModel, table=True):
+    __table_args__ = (
+        Index(
+            "ix_session_user_id_active",
+            "user_id",
+            sqlite_where=text("finished_at IS NULL"),
+            postgresql_where=text("finished_at IS NULL"),
+        ),
+    )
+
     id: UUID = Field(primary_key=True, default_factory=uuid4)
     created_at: datetime = Field(default_factory=datetime.now)
     finished_at: datetime | None = Field(default=None)
     user_id: UUID = Field(foreign_key="user.id")
+    summary: str | None = Field(default=None)
+    summary_until: datetime | None = Field(default=None)
 
     user: Optional["User"] = Relationship(back_populates="sessions")
     messages: List["Message"] = Relationship(back_populates="session")
+
+
+class MessageEmbedding(SQLModel, table=True):
+    message_id: UUID = Field(foreign_key="message.id", primary_key=True)
+    user_id: UUID = Field(foreign_key="user.id", index=True)
+    embedding: bytes
+
+
+class DeletionJob(SQLModel, table=True):
+    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    user_id: UUID = Field(index=True)
+    prefix: str
+    status: str = Field(default="pending", index=True)
+    attempts: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    error: Optional[str] = Field(default=None)
+    created_at: datetime = Field(default_factory=datetime.now)
+    finished_at: datetime | None = Field(default=None)
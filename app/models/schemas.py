@@ -1,5 +1,15 @@
-from pydantic import BaseModel, Field
-from typing import List
+import base64, binascii
+import numpy as np
+from pydantic import (
+    BaseModel,
+    Discriminator,
+    Field,
+    PrivateAttr,
+    Tag,
+    model_validator,
+)
+from typing import Annotated, List, Literal, Union
+from app.models.db import Message
 
 
 class Token(BaseModel):
@@ -39,9 +49,170 @@ class Line(BaseModel):
     type: int
 
 
+class CompactLine(BaseModel):
+    """
+    Compact form of `Line` with the points packed into a single base64 string.
+
+    The points are validated in bulk into a NumPy array instead of one Python
+    object per number. Converting with `from_line` and `to_line` is lossless.
+
+    Attributes:
+        points (str): Base64 of little-endian x, y pairs in `dtype`.
+        dtype (str): 'float32', or 'float64' when float32 would lose precision.
+    """
+
+    points: str = Field(description="Base64 of little-endian x, y pairs")
+    dtype: Literal["float32", "float64"] = Field(default="float32")
+    color: str
+    size: int
+    opacity: float
+    timestamp: int
+    type: int
+
+    _array: np.ndarray = PrivateAttr()
+
+    @model_validator(mode="after")
+    def _decode_points(self):
+        try:
+            raw = base64.b64decode(self.points, validate=True)
+        except binascii.Error as e:
+            raise ValueError("points must be base64 encoded") from e
+
+        dtype = np.dtype("<f4" if self.dtype == "float32" else "<f8")
+
+        if len(raw) % (2 * dtype.itemsize):
+            raise ValueError("points must hold whole x, y pairs")
+
+        self._array = np.frombuffer(raw, dtype=dtype)
+
+        return self
+
+    @property
+    def points_array(self) -> np.ndarray:
+        return self._array
+
+    @classmethod
+    def from_line(cls, line: Line) -> "CompactLine":
+        values = np.asarray(line.points, dtype=np.float64)
+        packed = values.astype("<f4")
+        dtype = "float32"
+
+        if not np.array_equal(packed.astype(np.float64), values):
+            packed = values.astype("<f8")
+            dtype = "float64"
+
+        return cls(
+            points=base64.b64encode(packed.tobytes()).decode("ascii"),
+            dtype=dtype,
+            **line.model_dump(exclude={"points"}),
+        )
+
+    def to_line(self) -> Line:
+        values = self._array.astype(np.float64)
+
+        if np.array_equal(values, np.round(values)):
+            points = values.astype(np.int64).tolist()
+        else:
+            points = values.tolist()
+
+        return Line(points=points, **self.model_dump(exclude={"points", "dtype"}))
+
+
+def _line_format(value) -> str:
+    points = (
+        value.get("points")
+        if isinstance(value, dict)
+        else getattr(value, "points", None)
+    )
+    return "compact" if isinstance(points, str) else "plain"
+
+
+AnyLine = Annotated[
+    Union[Annotated[Line, Tag("plain")], Annotated[CompactLine, Tag("compact")]],
+    Discriminator(_line_format),
+]
+
+
 class DrawRequest(BaseModel):
     lines: List[Line] = Field(description="The drawing lines to continue on.")
 
 
+class DrawDeltaRequest(BaseModel):
+    """
+    Schema for continuing a drawing the server already knows.
+
+    Attributes:
+        base_revision (int | None): Canvas revision the lines were added to, or
+            None to replace the whole canvas.
+        lines (List[Line | CompactLine]): Lines added since `base_revision`.
+    """
+
+    base_revision: int | None = Field(
+        default=None,
+        ge=0,
+        description="Revision the lines were added to, or null to send the whole canvas",
+    )
+    lines: List[AnyLine] = Field(
+        description="Lines added since the base revision, plain or compact."
+    )
+
+
+class DrawDeltaReturn(BaseModel):
+    """
+    Schema for the response of an incremental draw request.
+
+    Attributes:
+        revision (int): Canvas revision including the generated lines.
+        lines (List[Line]): The generated lines.
+    """
+
+    revision: int = Field(description="Canvas revision including the new lines")
+    lines: List[Line] = Field(description="The generated lines")
+
+
+class HistoryPage(BaseModel):
+    """
+    Schema for a page of chat history, newest messages first.
+
+    Attributes:
+        messages (List[Message]): The messages on this page.
+        next_cursor (str | None): Cursor for the next, older page, or None on the last page.
+    """
+
+    messages: List[Message] = Field(description="Messages, newest first")
+    next_cursor: str | None = Field(
+        default=None, description="Pass as `cursor` to fetch the next, older page"
+    )
+
+
+class DeletionJobReturn(BaseModel):
+    """
+    Schema for the status of a background deletion.
+
+    Attributes:
+        job_id (str): Id of the deletion job.
+        status (str): One of "pending", "running", "done" or "failed".
+    """
+
+    job_id: str = Field(description="Id of the deletion job")
+    status: str = Field(
+        description="pending, running, done or failed", examples=["pending"]
+    )
+
+
 class SessionReturn(BaseModel):
     visit_id: str
+
+
+class ImageStatsReturn(BaseModel):
+    """
+    Schema for the counters of the image worker pool and data-URL cache.
+
+    Attributes:
+        pool (dict): Workers, queued and active jobs, completed and failed jobs,
+            and the peak queue depth.
+        data_url_cache (dict): Entries, size, size limit, hits and misses.
+    """
+
+    pool: dict[str, int] = Field(description="Image worker pool counters")
+    data_url_cache: dict[str, int] = Field(description="Data-URL cache counters")
@@ -13,8 +13,9 @@ canvas_agent = Agent(
     You are an artist
     
     # Instructions
-    The provided image depicts the drawing in its current state.
-    Continue the drawing with new lines in various colors, opacities and sizes, based on the image provided.
+    The drawing in its current state is provided as an image, as a JSON file of its lines, or both.
+    Continue the drawing with new lines in various colors, opacities and sizes, based on the drawing provided.
+    Use the same coordinate space as the provided lines.
     """,
     tools=[
         CodeInterpreterTool(
@@ -22,3 +23,7 @@ canvas_agent = Agent(
         )
     ],
 )
+
+
+# Without a JSON file there is nothing for the code interpreter to read
+image_canvas_agent = canvas_agent.clone(tools=[])
@@ -0,0 +1,219 @@
+import logging
+from uuid import UUID
+from agents import TResponseInputItem
+from sqlmodel import select, desc
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.core.config import get_settings
+from app.core.image_processor import image_processor
+from app.core.vector_index import vector_index
+from app.models.db import Message, Session as Visit
+from app.utils.image import hash_distance, image_size
+from app.utils.tokens import message_tokens
+
+settings = get_settings()
+
+logger = logging.getLogger(__name__)
+
+
+def _skip_near_duplicate_images(
+    messages: list[Message], newer_phashes: list[str]
+) -> set[UUID]:
+    """
+    Returns the ids of messages whose image is a near-duplicate of a newer one.
+
+    `messages` must be ordered newest first. `newer_phashes` are the hashes of
+    images that will be sent after all of these messages.
+    """
+    kept_phashes = list(newer_phashes)
+    skipped: set[UUID] = set()
+
+    for message in messages:
+        if message.image_filename is None or message.image_phash is None:
+            continue
+
+        if any(
+            hash_distance(message.image_phash, phash) <= settings.phash_max_distance
+            for phash in kept_phashes
+        ):
+            skipped.add(message.id)
+        else:
+            kept_phashes.append(message.image_phash)
+
+    return skipped
+
+
+async def _token_count(message: Message) -> int:
+    """
+    Returns the cached token count of a message, counting it first for
+    messages stored before counts were kept.
+    """
+    if message.token_count is None:
+        dimensions = None
+
+        if message.image_filename is not None:
+            try:
+                dimensions = await image_processor.run(
+                    image_size, message.image_filename
+                )
+            except (OSError, ValueError):
+                pass
+
+        message.token_count = message_tokens(message.content, dimensions)
+
+    return message.token_count
+
+
+async def generate_input_items(
+    session: AsyncSession,
+    user_id: UUID,
+    session_id: UUID | None = None,
+    newer_phashes: list[str] | None = None,
+    query: str | None = None,
+    reserved_tokens: int = 0,
+) -> list[TResponseInputItem]:
+    """
+    Build the model input from the latest messages, of the active visit only
+    when `settings.context_scope` is "visit" and otherwise of the whole user.
+
+    Messages are added newest first for as long as they fit in
+    `settings.context_token_budget`, minus the `reserved_tokens` of the input
+    the caller adds itself. When a `query` is given, the older messages most
+    relevant to it are retrieved from the user's vector index and fill what
+    is left of the budget.
+
+    Messages of the active visit that are covered by its rolling summary are
+    left out and the summary is sent in their place.
+    """
+    if settings.context_scope == "visit" and session_id is not None:
+        scope = Message.session_id == session_id
+    else:
+        scope = Message.user_id == user_id
+
+    visit = await session.get(Visit, session_id) if session_id is not None else None
+    summary_until = visit.summary_until if visit and visit.summary else None
+
+    budget = settings.context_token_budget - reserved_tokens
+    remaining = budget
+
+    if summary_until is not None:
+        scope = scope & ~(
+            (Message.session_id == session_id) & (Message.timestamp <= summary_until)
+        )
+        summary = f"Summary of the visit so far:\n{visit.summary}"
+        remaining -= message_tokens(summary)
+
+    candidates = (
+        await session.exec(
+            select(Message)
+            .where(scope)
+            .order_by(desc(Message.timestamp))
+            .limit(settings.context_max_messages)
+        )
+    ).all()
+
+    uncounted = [message for message in candidates if message.token_count is None]
+    conversation_history: list[Message] = []
+
+    for message in candidates:
+        tokens = await _token_count(message)
+
+        if tokens > remaining:
+            break
+
+        conversation_history.append(message)
+        remaining -= tokens
+
+    retrieved = 0
+
+    if query and settings.rag_top_k > 0 and remaining > 0:
+        relevant_ids = await vector_index.search(
+            user_id,
+            query,
+            settings.rag_top_k,
+            exclude={message.id for message in conversation_history},
+            min_score=settings.rag_min_score,
+        )
+
+        if relevant_ids:
+            relevant_messages = {
+                message.id: message
+                for message in (
+                    await session.exec(
+                        select(Message).where(Message.id.in_(relevant_ids) & scope)
+                    )
+                ).all()
+            }
+            uncounted += [
+                message
+                for message in relevant_messages.values()
+                if message.token_count is None
+            ]
+            fitting: list[Message] = []
+
+            # best match first, so the budget goes to the most relevant ones
+            for id in relevant_ids:
+                message = relevant_messages.get(id)
+
+                if message is None:
+                    continue
+
+                tokens = await _token_count(message)
+
+                if tokens <= remaining:
+                    fitting.append(message)
+                    remaining -= tokens
+
+            retrieved = len(fitting)
+            conversation_history += sorted(
+                fitting, key=lambda message: message.timestamp, reverse=True
+            )
+
+    if uncounted:
+        session.add_all(uncounted)
+        await session.commit()
+
+    logger.info(
+        "Context uses %d of %d tokens: %d messages, %d retrieved, %s summary",
+        budget - remaining,
+        budget,
+        len(conversation_history),
+        retrieved,
+        "with" if summary_until is not None else "no",
+    )
+
+    skipped_images = _skip_near_duplicate_images(
+        conversation_history, newer_phashes or []
+    )
+
+    input_items: list[TResponseInputItem] = []
+
+    if summary_until is not None:
+        input_items.append({"role": "system", "type": "message", "content": summary})
+
+    for message in conversation_history.__reversed__():
+        if message.role == "user" or message.role == "assistant":
+            if message.image_filename != None and message.id not in skipped_images:
+                input_items.append(
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "input_image",
+                                "detail": "auto",
+                                "image_url": await image_processor.data_url(
+                                    message.image_filename
+                                ),
+                            }
+                        ],
+                    }
+                )
+
+            input_items.append(
+                {
+                    "role": message.role,
+                    "type": "message",
+                    "content": message.content,
+                }
+            )
+
+    return input_items
@@ -0,0 +1,131 @@
+import asyncio, logging
+from datetime import datetime
+from uuid import UUID
+from sqlmodel import select, update
+from app.core.config import get_settings
+from app.core.database import db
+from app.core.storage import Storage, derivative_storage, upload_storage
+from app.models.db import DeletionJob
+
+settings = get_settings()
+
+logger = logging.getLogger(__name__)
+
+
+class DeletionQueue:
+    """
+    Deletes stored files in the background.
+
+    Every job is a row in the `deletionjob` table, written in the same
+    transaction as the data it belongs to, and is only marked "done" once
+    its files are gone. Jobs that were interrupted by a crash or restart, or
+    that failed fewer than `max_attempts` times, are run again on startup.
+    Deleting a prefix is idempotent, so running a job twice is harmless.
+    """
+
+    def __init__(self, storages: list[Storage], max_attempts: int):
+        self.storages = storages
+        self.max_attempts = max_attempts
+        self._queue: asyncio.Queue[DeletionJob] = asyncio.Queue()
+        self._jobs: dict[UUID, tuple[UUID, asyncio.Future]] = {}
+        self._task: asyncio.Task | None = None
+        self._idle = True
+        self._stopping = False
+
+    def submit(self, job: DeletionJob) -> None:
+        """
+        Queues a job that has been committed to the database.
+        """
+        if job.id in self._jobs:
+            return
+
+        self._jobs[job.id] = (job.user_id, asyncio.get_running_loop().create_future())
+        self._queue.put_nowait(job)
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def resume(self) -> None:
+        """
+        Queues the jobs left unfinished by a previous run.
+        """
+        async with db.async_session() as session:
+            jobs = (
+                await session.exec(
+                    select(DeletionJob)
+                    .where(
+                        DeletionJob.status.in_(["pending", "running", "failed"])
+                        & (DeletionJob.attempts < self.max_attempts)
+                    )
+                    .order_by(DeletionJob.created_at)
+                )
+            ).all()
+
+        for job in jobs:
+            self.submit(job)
+
+    async def wait_for(self, user_id: UUID) -> None:
+        """
+        Returns once the queued jobs of the user have run, so that new files
+        are not written only to be deleted by an older job.
+        """
+        futures = [future for owner, future in self._jobs.values() if owner == user_id]
+
+        if futures:
+            await asyncio.wait(futures)
+
+    async def shutdown(self) -> None:
+        """
+        Lets the running job finish and stops. Queued jobs stay in the table
+        and are resumed on startup.
+        """
+        self._stopping = True
+
+        if self._task is not None:
+            # cancelling a job could leave its database work running in a thread
+            if self._idle:
+                self._task.cancel()
+
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            self._idle = True
+            job = await self._queue.get()
+            self._idle = False
+
+            try:
+                await self._process(job)
+            except Exception:
+                logger.exception("Deletion job %s could not be updated", job.id)
+            finally:
+                _, future = self._jobs.pop(job.id)
+                future.set_result(None)
+
+    async def _process(self, job: DeletionJob) -> None:
+        await self._update(job.id, status="running", attempts=DeletionJob.attempts + 1)
+
+        try:
+            for storage in self.storages:
+                await asyncio.to_thread(storage.delete_prefix, job.prefix)
+        except Exception as e:
+            logger.exception("Deletion job %s failed", job.id)
+            await self._update(job.id, status="failed", error=str(e))
+            return
+
+        await self._update(
+            job.id, status="done", error=None, finished_at=datetime.now()
+        )
+
+    async def _update(self, job_id: UUID, **values) -> None:
+        async with db.async_session() as session:
+            await session.exec(
+                update(DeletionJob).where(DeletionJob.id == job_id).values(**values)
+            )
+            await session.commit()
+
+
+deletion_queue = DeletionQueue(
+    [upload_storage, derivative_storage],
+    max_attempts=settings.deletion_max_attempts,
+)
@@ -0,0 +1,82 @@
+import hashlib, re
+from abc import ABC, abstractmethod
+import numpy as np
+from app.core.config import get_settings
+
+settings = get_settings()
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class EmbeddingProvider(ABC):
+    """
+    Turns texts into L2-normalized float32 vectors of `dimensions` length.
+    """
+
+    dimensions: int
+
+    @abstractmethod
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        """
+        Returns an array of shape (len(texts), dimensions).
+        """
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Deterministic local embeddings built by hashing words and word pairs into
+    a fixed number of buckets. Needs no network access, which makes it suitable
+    for development and tests.
+    """
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+
+    def _bucket(self, feature: str) -> tuple[int, float]:
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        return value % self.dimensions, 1.0 if value >> 63 else -1.0
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+
+        for row, text in enumerate(texts):
+            words = TOKEN_PATTERN.findall(text.lower())
+            features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+            for feature in features:
+                index, sign = self._bucket(feature)
+                vectors[row, index] += sign
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """
+    Embeddings from the OpenAI embeddings API.
+    """
+
+    def __init__(self, model: str, dimensions: int):
+        from openai import AsyncOpenAI
+
+        self.model = model
+        self.dimensions = dimensions
+        self._client = AsyncOpenAI()
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        response = await self._client.embeddings.create(
+            model=self.model, input=texts, dimensions=self.dimensions
+        )
+        vectors = np.array([item.embedding for item in response.data], np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    if settings.embedding_provider == "openai":
+        return OpenAIEmbeddingProvider(
+            settings.embedding_model, settings.embedding_dimensions
+        )
+
+    return HashingEmbeddingProvider(settings.embedding_dimensions)
@@ -0,0 +1,191 @@
+import asyncio, logging
+from uuid import UUID
+from sqlalchemy import insert
+from app.core.config import get_settings
+from app.core.database import db
+from app.core.vector_index import vector_index
+from app.models.db import Message, MessageEmbedding
+from app.services.summarizer import summarizer
+
+settings = get_settings()
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+    """
+    Write-behind queue for chat messages.
+
+    Messages from all connections are collected and written together in one
+    transaction, with their embeddings, once `batch_size` are waiting or
+    `flush_interval` seconds have passed. Writes go through an async session,
+    so the event loop never waits for the database lock.
+
+    Messages get their id and timestamp when they are created, so callers
+    can use them right away. Code that reads a user's messages back from
+    the database first awaits `wait_for`, which flushes that user's pending
+    messages.
+
+    When a batch fails to write, its messages are written one at a time, so
+    a bad message does not take the rest of the batch down with it.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: list[Message] = []
+        self._pending_flushed: asyncio.Future | None = None
+        self._writing: list[Message] = []
+        self._writing_flushed: asyncio.Future | None = None
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+        self._task: asyncio.Task | None = None
+
+    def add(self, messages: list[Message]) -> asyncio.Future:
+        """
+        Queues messages for writing. The returned future resolves once they
+        are stored.
+        """
+        if self._pending_flushed is None:
+            self._pending_flushed = asyncio.get_running_loop().create_future()
+
+        self._pending += messages
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+        return self._pending_flushed
+
+    async def wait_for(self, user_id: UUID) -> None:
+        """
+        Returns once every message queued for the user so far is stored.
+        """
+        for messages, flushed in (
+            (self._writing, self._writing_flushed),
+            (self._pending, self._pending_flushed),
+        ):
+            if flushed is not None and any(
+                message.user_id == user_id for message in messages
+            ):
+                self._wakeup.set()
+                await asyncio.shield(flushed)
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._pending:
+                return
+
+            batch, flushed = self._pending, self._pending_flushed
+            self._pending, self._pending_flushed = [], None
+            self._writing, self._writing_flushed = batch, flushed
+
+            try:
+                embeddings = await self._embed(batch)
+
+                try:
+                    await self._write(batch, embeddings)
+                except Exception:
+                    logger.exception(
+                        "Writing %d messages failed, writing them one by one",
+                        len(batch),
+                    )
+                    batch, embeddings = await self._write_each(batch, embeddings)
+            except Exception as e:
+                logger.exception("Writing %d messages failed", len(batch))
+                flushed.set_exception(e)
+                # mark the error as seen when nobody waits for this batch
+                flushed.exception()
+                return
+            finally:
+                self._writing, self._writing_flushed = [], None
+
+            vector_index.remember(embeddings)
+            flushed.set_result(None)
+
+        for session_id in {message.session_id for message in batch}:
+            summarizer.schedule(session_id)
+
+    async def shutdown(self) -> None:
+        """
+        Stops the background flushes and writes whatever is still queued.
+        """
+        # let a flush that is under way finish rather than cancel it mid-write
+        self._stopping = True
+        self._wakeup.set()
+
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+
+        await self.flush()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except TimeoutError:
+                pass
+
+            self._wakeup.clear()
+
+            await self.flush()
+
+    async def _embed(self, batch: list[Message]) -> list[MessageEmbedding]:
+        try:
+            return await vector_index.embed(batch)
+        except Exception:
+            # the index embeds messages without one when it is loaded
+            logger.exception("Embedding %d messages failed", len(batch))
+            return []
+
+    async def _write(self, batch: list[Message], embeddings: list[MessageEmbedding]):
+        async with db.async_session() as session:
+            await session.exec(
+                insert(Message), params=[message.model_dump() for message in batch]
+            )
+
+            if embeddings:
+                await session.exec(
+                    insert(MessageEmbedding),
+                    params=[embedding.model_dump() for embedding in embeddings],
+                )
+
+            await session.commit()
+
+    async def _write_each(
+        self, batch: list[Message], embeddings: list[MessageEmbedding]
+    ) -> tuple[list[Message], list[MessageEmbedding]]:
+        """
+        Writes messages in separate transactions, dropping the ones that fail.
+
+        Returns the messages and embeddings that were stored.
+        """
+        embeddings_by_message = {
+            embedding.message_id: embedding for embedding in embeddings
+        }
+        stored, stored_embeddings = [], []
+
+        for message in batch:
+            embedding = embeddings_by_message.get(message.id)
+
+            try:
+                await self._write([message], [embedding] if embedding else [])
+            except Exception:
+                logger.exception("Dropping message %s that failed to write", message.id)
+                continue
+
+            stored.append(message)
+
+            if embedding:
+                stored_embeddings.append(embedding)
+
+        return stored, stored_embeddings
+
+
+message_writer = MessageWriter(
+    batch_size=settings.message_flush_batch_size,
+    flush_interval=settings.message_flush_interval_ms / 1000,
+)
@@ -1,16 +1,25 @@
-import asyncio, base64, json, os
+import asyncio, base64, logging, os, time
+import orjson
 from uuid import UUID, uuid4
-from agents import Runner, TResponseInputItem
+from agents import Runner, RunResultStreaming, TResponseInputItem
 from dotenv import load_dotenv
 from openai.types.responses import ResponseTextDeltaEvent
 from app.core.config import get_settings
 from app.models.db import User
 from app.models.schemas import Line
-from app.services.agents.canvas_agent import canvas_agent
+from app.core.image_processor import image_processor
+from app.services.agents.canvas_agent import canvas_agent, image_canvas_agent
 from app.services.agents.art_critic_agent import art_critic_agent
+from app.utils.json_stream import JsonArrayItemParser
+from app.utils.raster import canvas_extent, render_lines
+from app.utils.spool import spool_write
+from app.utils.stream import coalesce
+from app.utils.strokes import SimplifyStats, simplify_lines
 
 settings = get_settings()
 
+logger = logging.getLogger(__name__)
+
 load_dotenv(".env.development")
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
@@ -22,6 +31,25 @@ if not OPENAI_ORG_ID:
     raise ValueError("OPENAI_ORG_ID environment variable is required")
 
 
+def _estimate_raw_size(
+    simplified: list[Line], stats: SimplifyStats, payload_size: int
+) -> int:
+    """
+    Estimates the serialized size of the lines before simplification from
+    the point counts, without serializing them: the dropped points are
+    counted at the payload's average bytes per kept point.
+    """
+    if not simplified or not stats.points_after:
+        return payload_size
+
+    line_bytes = len(orjson.dumps(simplified[0].model_dump(exclude={"points"})))
+    point_bytes = max(payload_size - stats.lines * line_bytes, 0) / stats.points_after
+
+    return payload_size + round(
+        (stats.points_before - stats.points_after) * point_bytes
+    )
+
+
 class StudioVisit:
     def __init__(self, session_id: UUID, user: User):
         self.session_id: UUID = session_id
@@ -30,38 +58,135 @@ class StudioVisit:
     async def chat(self, input_items: list[TResponseInputItem]):
         result = Runner.run_streamed(art_critic_agent, input=input_items)
 
-        async for event in result.stream_events():
-            await asyncio.sleep(0.1)
+        chunks = coalesce(
+            self._text_deltas(result),
+            flush_interval=settings.stream_flush_interval_ms / 1000,
+            flush_bytes=settings.stream_flush_bytes,
+            pacing=settings.stream_pacing_ms / 1000,
+        )
+
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            # stop generating, and paying for, output nobody will read
+            if not result.is_complete:
+                result.cancel()
 
+    async def _text_deltas(self, result: RunResultStreaming):
+        async for event in result.stream_events():
             if event.type == "raw_response_event" and isinstance(
                 event.data, ResponseTextDeltaEvent
             ):
                 yield event.data.delta
 
-    async def draw(self, lines: list[Line]):
-        os.makedirs("tmp/draw/", exist_ok=True)
+    async def _draw_input(self, lines: list[Line]):
+        """
+        Builds the canvas agent and its input for the current drawing.
+        """
         temp_filename = f"{uuid4().hex}.json"
 
-        with open(f"tmp/draw/{temp_filename}", "x") as file:
-            json.dump([line.model_dump() for line in lines], file)
+        simplified, stats = simplify_lines(
+            lines, settings.stroke_tolerance, settings.stroke_precision
+        )
+
+        payload = orjson.dumps([line.model_dump() for line in simplified])
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Simplified %d lines: %d -> %d points, ~%d -> %d bytes",
+                stats.lines,
+                stats.points_before,
+                stats.points_after,
+                _estimate_raw_size(simplified, stats, len(payload)),
+                len(payload),
+            )
 
-        with open(f"tmp/draw/{temp_filename}", "rb") as f:
-            file_data = base64.b64encode(f.read()).decode("utf-8")
+        if settings.draw_debug_spool:
+            await asyncio.to_thread(
+                spool_write,
+                settings.draw_spool_dir,
+                temp_filename,
+                payload,
+                settings.draw_spool_max_bytes,
+            )
 
-        result = await Runner.run(
-            canvas_agent,
-            input=[
+        content = []
+
+        if settings.draw_input_mode in ("json", "both"):
+            file_data = base64.b64encode(payload).decode("utf-8")
+            content.append(
                 {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "input_file",
-                            "filename": temp_filename,
-                            "file_data": f"data:application/json;base64,{file_data}",
-                        }
-                    ],
+                    "type": "input_file",
+                    "filename": temp_filename,
+                    "file_data": f"data:application/json;base64,{file_data}",
+                }
+            )
+
+        if settings.draw_input_mode in ("image", "both"):
+            width, height = canvas_extent(simplified)
+            image = await image_processor.run(
+                render_lines, simplified, settings.canvas_raster_max_side
+            )
+            image_data = base64.b64encode(image).decode("utf-8")
+            content += [
+                {
+                    "type": "input_text",
+                    "text": f"The image shows canvas coordinates 0-{width} by 0-{height}.",
+                },
+                {
+                    "type": "input_image",
+                    "detail": "auto",
+                    "image_url": f"data:image/png;base64,{image_data}",
                 },
-            ],
+            ]
+
+        agent = (
+            image_canvas_agent if settings.draw_input_mode == "image" else canvas_agent
+        )
+
+        return agent, [{"role": "user", "content": content}]
+
+    async def draw(self, lines: list[Line]):
+        agent, input_items = await self._draw_input(lines)
+
+        started = time.perf_counter()
+
+        result = await Runner.run(agent, input=input_items)
+
+        logger.info(
+            "Canvas agent answered in %.2fs (input mode: %s)",
+            time.perf_counter() - started,
+            settings.draw_input_mode,
         )
 
         return result.final_output_as(list[Line])
+
+    async def draw_stream(self, lines: list[Line]):
+        """
+        Yields each generated line as soon as the agent has finished writing it.
+        """
+        agent, input_items = await self._draw_input(lines)
+
+        started = time.perf_counter()
+        first_line_at: float | None = None
+
+        result = Runner.run_streamed(agent, input=input_items)
+        parser = JsonArrayItemParser()
+
+        async for event in result.stream_events():
+            if event.type == "raw_response_event" and isinstance(
+                event.data, ResponseTextDeltaEvent
+            ):
+                for item in parser.feed(event.data.delta):
+                    if first_line_at is None:
+                        first_line_at = time.perf_counter() - started
+
+                    yield Line.model_validate(item)
+
+        logger.info(
+            "Canvas agent streamed in %.2fs, first line after %.2fs (input mode: %s)",
+            time.perf_counter() - started,
+            first_line_at or 0.0,
+            settings.draw_input_mode,
+        )
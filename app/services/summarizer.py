@@ -0,0 +1,111 @@
+import asyncio, logging
+from uuid import UUID
+from agents import Runner
+from sqlmodel import select, update
+from app.core.config import get_settings
+from app.core.database import db
+from app.models.db import Message, Session
+from app.services.agents.summary_agent import summary_agent
+from app.utils.tokens import message_tokens
+
+settings = get_settings()
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationSummarizer:
+    """
+    Compacts the older messages of a visit into a rolling summary stored on
+    the `Session`, in background tasks outside of the request path.
+
+    A summary covers every message of the visit up to `Session.summary_until`.
+    Once the messages after that, minus the most recent ones that are always
+    sent verbatim, exceed `settings.summary_trigger_tokens`, they are folded
+    into the summary. At most one run per visit is in flight, and a run only
+    stores its result if the summary did not change while it was running.
+    """
+
+    def __init__(self, trigger_tokens: int, keep_recent: int):
+        self.trigger_tokens = trigger_tokens
+        self.keep_recent = keep_recent
+        self._tasks: dict[UUID, asyncio.Task] = {}
+
+    def schedule(self, session_id: UUID) -> None:
+        task = self._tasks.get(session_id)
+
+        if task is not None and not task.done():
+            return
+
+        task = asyncio.create_task(self._run(session_id))
+        self._tasks[session_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(session_id, None))
+
+    async def shutdown(self) -> None:
+        for task in list(self._tasks.values()):
+            task.cancel()
+
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def _run(self, session_id: UUID) -> None:
+        try:
+            await self._summarize(session_id)
+        except Exception:
+            logger.exception("Summarizing visit %s failed", session_id)
+
+    async def _summarize(self, session_id: UUID) -> None:
+        async with db.async_session() as session:
+            visit = await session.get(Session, session_id)
+
+            if visit is None:
+                return
+
+            statement = select(Message).where(Message.session_id == session_id)
+
+            if visit.summary_until is not None:
+                statement = statement.where(Message.timestamp > visit.summary_until)
+
+            messages = (await session.exec(statement.order_by(Message.timestamp))).all()
+            to_summarize = messages[: max(0, len(messages) - self.keep_recent)]
+
+            if (
+                sum(
+                    message.token_count or message_tokens(message.content)
+                    for message in to_summarize
+                )
+                < self.trigger_tokens
+            ):
+                return
+
+            previous_summary = visit.summary
+            previous_until = visit.summary_until
+
+        transcript = "\n\n".join(
+            f"{message.role}: {message.content}" for message in to_summarize
+        )
+        notes = previous_summary or "(none yet)"
+
+        result = await Runner.run(
+            summary_agent,
+            input=f"# Notes so far\n{notes}\n\n# Conversation\n{transcript}",
+        )
+
+        async with db.async_session() as session:
+            # only the run that started from the stored summary may replace it
+            await session.exec(
+                update(Session)
+                .where(
+                    (Session.id == session_id)
+                    & (Session.summary_until == previous_until)
+                )
+                .values(
+                    summary=result.final_output,
+                    summary_until=to_summarize[-1].timestamp,
+                )
+            )
+            await session.commit()
+
+
+summarizer = ConversationSummarizer(
+    trigger_tokens=settings.summary_trigger_tokens,
+    keep_recent=settings.context_recent_messages,
+)
@@ -1,61 +1,375 @@
 import base64
-import os, hashlib
-from PIL import Image
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import BinaryIO
+from pathlib import Path
+from PIL import Image, ImageOps
 from io import BytesIO
-import uuid
-import os
 from app.core.config import get_settings
+from app.core.storage import Storage, derivative_storage, upload_storage
 
 settings = get_settings()
 
 
+class DataUrlCache:
+    """
+    Bounded LRU cache of model-ready image data-URLs keyed by content hash.
+
+    Entries are evicted least recently used first once the combined size of
+    the cached data-URLs exceeds `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            value = self._entries.get(key)
+
+            if value is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        if len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = value
+            self._size += len(value)
+
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def _pop(self, key: str) -> None:
+        value = self._entries.pop(key, None)
+
+        if value is not None:
+            self._size -= len(value)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "size": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+data_url_cache = DataUrlCache(settings.image_cache_max_bytes)
+
+
+MIME_TYPES = {
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+}
+
+MODEL_FORMATS = {
+    "webp": (".webp", "WEBP"),
+    "jpeg": (".jpg", "JPEG"),
+}
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+@dataclass
+class StoredImage:
+    filename: str
+    size: int
+    phash: str | None = None
+    width: int = 0
+    height: int = 0
+
+
+def content_hash(contents: bytes) -> str:
+    return hashlib.sha256(contents).hexdigest()
+
+
+def stream_hash(
+    source: BinaryIO,
+    max_bytes: int = settings.max_upload_bytes,
+    chunk_size: int = settings.upload_chunk_size,
+) -> tuple[str, int]:
+    """
+    Hashes a file object in chunks and rewinds it.
+
+    Raises ImageTooLargeError as soon as more than `max_bytes` have been read.
+
+    Returns:
+        The SHA-256 hex digest and the size in bytes.
+    """
+    digest = hashlib.sha256()
+    size = 0
+
+    while chunk := source.read(chunk_size):
+        size += len(chunk)
+
+        if size > max_bytes:
+            raise ImageTooLargeError(f"Image exceeds {max_bytes} bytes")
+
+        digest.update(chunk)
+
+    source.seek(0)
+
+    return digest.hexdigest(), size
+
+
+def normalize_image(image: Image.Image, max_side: int = settings.image_max_side):
+    """
+    Applies EXIF orientation, converts to RGB(A) and caps the longest side.
+    """
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+    return image
+
+
+def flatten_alpha(image: Image.Image) -> Image.Image:
+    """
+    Composites an RGBA image onto a white background.
+    """
+    if image.mode != "RGBA":
+        return image.convert("RGB")
+
+    background = Image.new("RGB", image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel("A"))
+    return background
+
+
+def perceptual_hash(image: Image.Image, hash_size: int = 8) -> str:
+    """
+    Computes a difference hash (dHash) of an image as a hex string.
+
+    Visually similar images, such as two versions of the same drawing, produce
+    hashes with a small Hamming distance.
+    """
+    grayscale = flatten_alpha(image).convert("L")
+    pixels = np.asarray(
+        grayscale.resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS),
+        dtype=np.int16,
+    )
+    bits = pixels[:, 1:] > pixels[:, :-1]
+
+    return np.packbits(bits.flatten()).tobytes().hex()
+
+
+def hash_distance(a: str, b: str) -> int:
+    return (int(a, 16) ^ int(b, 16)).bit_count()
+
+
+def encode_image(image: Image.Image, format: str, quality: int = 85) -> bytes:
+    """
+    Encodes an image as PNG, WEBP or JPEG. JPEG output is flattened onto white.
+    """
+    buffer = BytesIO()
+
+    if format == "PNG":
+        image.save(buffer, format="PNG")
+    elif format == "JPEG":
+        image = flatten_alpha(image)
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    else:
+        image.save(buffer, format=format, quality=quality, method=4)
+
+    return buffer.getvalue()
+
+
+def model_variant_filename(
+    filename: str, model_format: str | None = settings.model_image_format
+) -> str | None:
+    """
+    Returns the filename of the compressed model-input variant of an upload.
+    """
+    if model_format not in MODEL_FORMATS:
+        return None
+
+    extension, _ = MODEL_FORMATS[model_format]
+    return str(Path(filename).with_suffix(extension))
+
+
 def convert_to_png_and_save(
-    contents: bytes,
+    contents: bytes | BinaryIO,
     user_id: str,
-    output_dir: str = settings.uploads_dir,
-) -> str:
+    storage: Storage = upload_storage,
+    digest: str | None = None,
+    size: int | None = None,
+) -> StoredImage:
     """
-    Validates and converts an image to PNG format.
+    Validates an image, re-encodes it as PNG and saves it.
+
+    The longest side is capped at `settings.image_max_side`. When
+    `settings.model_image_format` is set, a compressed variant for model input
+    is written next to the PNG. Files are named by the SHA-256 of the uploaded
+    content, so uploading the same image twice stores it only once.
 
     Args:
-        contents: Raw bytes of the uploaded image.
-        output_dir: Directory to save the converted PNG.
+        contents: Raw bytes of the uploaded image, or a seekable file holding them.
+        storage: Storage to save the converted PNG to.
+        digest: SHA-256 of the contents, when already known.
+        size: Size of the contents in bytes, when already known.
 
     Returns:
-        The hashed filename.
+        The hashed filename, the upload size, the perceptual hash and the
+        dimensions of the stored image.
     """
+    if isinstance(contents, bytes):
+        digest = digest or content_hash(contents)
+        size = len(contents)
+    elif digest is None or size is None:
+        digest, size = stream_hash(contents)
+
+    filename = f"{user_id}/{digest}.png"
+
+    if storage.exists(filename):
+        with Image.open(BytesIO(storage.read(filename))) as stored_image:
+            phash = perceptual_hash(stored_image)
+            width, height = stored_image.size
+
+        return StoredImage(filename, size, phash, width, height)
+
     try:
-        image = Image.open(BytesIO(contents))
+        image = Image.open(
+            BytesIO(contents) if isinstance(contents, bytes) else contents
+        )
+        image.load()
     except Exception as e:
         raise ValueError("Invalid image file") from e
 
-    if image.mode not in ("RGB", "RGBA"):
-        image = image.convert("RGBA")
+    image = normalize_image(image)
+
+    variant_filename = model_variant_filename(filename)
 
-    user_output_dir = f"{output_dir}/{user_id}"
+    if variant_filename:
+        extension, variant_format = MODEL_FORMATS[settings.model_image_format]
+        storage.write(
+            variant_filename,
+            encode_image(image, variant_format, settings.model_image_quality),
+            content_type=MIME_TYPES[extension],
+        )
 
-    os.makedirs(user_output_dir, exist_ok=True)
+    storage.write(filename, encode_image(image, "PNG"), content_type="image/png")
 
-    temp_filename = f"{uuid.uuid4().hex}.png"
-    hash_object = hashlib.sha256(temp_filename.encode())
-    hashed_filename = hash_object.hexdigest() + ".png"
+    return StoredImage(filename, size, perceptual_hash(image), *image.size)
 
-    file_path = os.path.join(user_output_dir, hashed_filename)
 
-    counter = 1
+def save_upload_stream(source: BinaryIO, user_id: str) -> StoredImage:
+    """
+    Hashes an upload in chunks and stores it, decoding straight from `source`
+    so the upload is never held in memory as a whole.
+
+    `source` is the file Starlette spooled while parsing the multipart body,
+    so the size cap only bounds the work done after parsing; the upload size
+    middleware rejects oversized requests before that.
+    """
+    digest, size = stream_hash(source)
+
+    return convert_to_png_and_save(source, user_id, digest=digest, size=size)
 
-    while os.path.exists(file_path):
-        hashed_filename = f"{hash_object.hexdigest()}_{counter}.png"
-        file_path = os.path.join(user_output_dir, hashed_filename)
-        counter += 1
 
-    with open(file_path, "wb") as f:
-        f.write(contents)
+def image_size(filename: str, storage: Storage = upload_storage) -> tuple[int, int]:
+    """
+    Reads the dimensions of a stored image from its header.
+    """
+    with storage.local_path(filename) as path, Image.open(path) as image:
+        return image.size
+
+
+def thumbnail_width(width: int, widths: list[int] = settings.thumbnail_widths) -> int:
+    """
+    Snaps a requested width to the smallest configured thumbnail width that
+    covers it, so arbitrary widths cannot flood the derivative cache.
+    """
+    for candidate in sorted(widths):
+        if candidate >= width:
+            return candidate
+
+    return max(widths)
+
+
+def thumbnail_filename(filename: str, width: int) -> str:
+    path = Path(filename)
+    return str(path.with_name(f"{path.stem}_w{width}.webp"))
+
+
+def create_thumbnail(
+    filename: str,
+    width: int,
+    source_storage: Storage = upload_storage,
+    target_storage: Storage = derivative_storage,
+) -> str:
+    """
+    Renders a WebP thumbnail of at most `width` pixels wide for an upload and
+    stores it as a derivative.
+
+    Returns:
+        The derivative key of the thumbnail.
+    """
+    thumbnail_key = thumbnail_filename(filename, width)
+
+    if target_storage.exists(thumbnail_key):
+        return thumbnail_key
+
+    with source_storage.local_path(filename) as source_path:
+        with Image.open(source_path) as image:
+            image = normalize_image(image, max_side=max(image.size))
+
+            if image.width > width:
+                height = max(1, round(image.height * width / image.width))
+                image = image.resize((width, height), Image.Resampling.LANCZOS)
+
+            data = encode_image(image, "WEBP", settings.model_image_quality)
+
+    target_storage.write(thumbnail_key, data, content_type="image/webp")
+
+    return thumbnail_key
+
+
+def image_to_base64(filename: str, storage: Storage = upload_storage) -> str:
+    return base64.b64encode(storage.read(filename)).decode("utf-8")
+
+
+def data_url_key(filename: str) -> str:
+    return Path(filename).stem
+
+
+def encode_data_url(filename: str, storage: Storage = upload_storage) -> str:
+    """
+    Reads a stored upload and encodes it as a data-URL, bypassing the cache.
+
+    The compressed model variant is used when present, with a MIME type that
+    matches its format.
+    """
+    source = filename
+    variant_filename = model_variant_filename(filename)
 
-    return f"{user_id}/{hashed_filename}"
+    if variant_filename and storage.exists(variant_filename):
+        source = variant_filename
 
+    mime_type = MIME_TYPES.get(Path(source).suffix.lower(), "image/png")
+    b64_image = image_to_base64(source, storage)
 
-def image_to_base64(image_path):
-    with open(image_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
-    return encoded_string
+    return f"data:{mime_type};base64,{b64_image}"
@@ -0,0 +1,58 @@
+import orjson
+
+
+class JsonArrayItemParser:
+    """
+    Incrementally scans streamed JSON text and returns every object that is a
+    direct element of an array as soon as its closing brace has arrived.
+
+    With `{"response": [{...}, {...}]}` arriving in arbitrary chunks, each
+    `{...}` element is returned from the `feed` call that completes it.
+    """
+
+    def __init__(self):
+        self._text: list[str] = []
+        self._stack: list[str] = []
+        self._in_string = False
+        self._escaped = False
+        self._item_depth: int | None = None
+
+    def feed(self, chunk: str) -> list[dict]:
+        items: list[dict] = []
+
+        for char in chunk:
+            if self._item_depth is not None:
+                self._text.append(char)
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if (
+                    char == "{"
+                    and self._item_depth is None
+                    and self._stack
+                    and self._stack[-1] == "["
+                ):
+                    self._item_depth = len(self._stack)
+                    self._text = [char]
+
+                self._stack.append(char)
+            elif char in "}]":
+                if self._stack:
+                    self._stack.pop()
+
+                if char == "}" and self._item_depth == len(self._stack):
+                    items.append(orjson.loads("".join(self._text)))
+                    self._item_depth = None
+                    self._text = []
+
+        return items
@@ -0,0 +1,66 @@
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw
+from app.models.schemas import Line
+from app.utils.image import encode_image
+
+
+def canvas_extent(lines: list[Line]) -> tuple[int, int]:
+    """
+    Returns the width and height of the canvas area covered by the lines,
+    measured from the canvas origin.
+    """
+    width = height = 1.0
+
+    for line in lines:
+        if len(line.points) < 2:
+            continue
+
+        coordinates = np.asarray(line.points[: len(line.points) // 2 * 2]).reshape(
+            -1, 2
+        )
+        margin = line.size / 2
+        width = max(width, float(coordinates[:, 0].max()) + margin)
+        height = max(height, float(coordinates[:, 1].max()) + margin)
+
+    return int(np.ceil(width)), int(np.ceil(height))
+
+
+def render_lines(lines: list[Line], max_side: int) -> bytes:
+    """
+    Rasterizes lines onto a white canvas and returns it as PNG.
+
+    Canvas coordinates map to pixels one-to-one, scaled down uniformly when the
+    drawing is larger than `max_side`.
+    """
+    width, height = canvas_extent(lines)
+    scale = min(1.0, max_side / max(width, height))
+
+    image = Image.new("RGB", (round(width * scale), round(height * scale)), "white")
+    draw = ImageDraw.Draw(image, "RGBA")
+
+    for line in lines:
+        if len(line.points) < 2:
+            continue
+
+        try:
+            red, green, blue = ImageColor.getrgb(line.color)[:3]
+        except ValueError:
+            red, green, blue = 0, 0, 0
+
+        fill = (red, green, blue, round(min(max(line.opacity, 0), 1) * 255))
+        stroke_width = max(1, round(line.size * scale))
+        coordinates = (
+            np.asarray(line.points[: len(line.points) // 2 * 2], dtype=np.float64)
+            * scale
+        )
+
+        if len(coordinates) == 2:
+            x, y = coordinates
+            radius = stroke_width / 2
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=fill)
+        else:
+            draw.line(
+                coordinates.tolist(), fill=fill, width=stroke_width, joint="curve"
+            )
+
+    return encode_image(image, "PNG")
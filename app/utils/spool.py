@@ -0,0 +1,25 @@
+import os
+from pathlib import Path
+
+
+def spool_write(directory: str, filename: str, data: bytes, max_bytes: int) -> None:
+    """
+    Writes a file to a spool directory, then removes the oldest files until the
+    directory holds at most `max_bytes`.
+    """
+    spool_dir = Path(directory)
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    (spool_dir / filename).write_bytes(data)
+
+    files = sorted(
+        (entry for entry in os.scandir(spool_dir) if entry.is_file()),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    total = sum(entry.stat().st_size for entry in files)
+
+    for entry in files:
+        if total <= max_bytes:
+            break
+
+        total -= entry.stat().st_size
+        os.remove(entry.path)
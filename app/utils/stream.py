@@ -0,0 +1,70 @@
+import asyncio
+from typing import AsyncIterator
+
+
+async def _next(iterator: AsyncIterator[str]) -> str:
+    return await anext(iterator)
+
+
+async def coalesce(
+    source: AsyncIterator[str],
+    flush_interval: float,
+    flush_bytes: int,
+    pacing: float = 0.0,
+) -> AsyncIterator[str]:
+    """
+    Joins text deltas into larger chunks.
+
+    The first delta is passed through immediately to keep time-to-first-token
+    low. Later deltas are buffered until `flush_bytes` have been collected or
+    `flush_interval` seconds have passed since the oldest buffered delta,
+    whichever comes first. `pacing` adds a delay after each chunk, for a
+    typing effect in the UI.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = aiter(source)
+    pending: asyncio.Task | None = None
+    buffer: list[str] = []
+    buffered_bytes = 0
+    deadline: float | None = None
+    first = True
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.create_task(_next(iterator))
+
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+
+            if pending in done:
+                task, pending = pending, None
+
+                try:
+                    delta = task.result()
+                except StopAsyncIteration:
+                    break
+
+                if not buffer:
+                    deadline = loop.time() + flush_interval
+
+                buffer.append(delta)
+                buffered_bytes += len(delta.encode("utf-8"))
+
+                if not first and buffered_bytes < flush_bytes:
+                    continue
+
+                first = False
+
+            yield "".join(buffer)
+
+            buffer, buffered_bytes, deadline = [], 0, None
+
+            if pacing > 0:
+                await asyncio.sleep(pacing)
+
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None:
+            pending.cancel()
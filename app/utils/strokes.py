@@ -0,0 +1,96 @@
+from dataclasses import dataclass
+import numpy as np
+from app.models.schemas import Line
+
+
+@dataclass
+class SimplifyStats:
+    lines: int = 0
+    points_before: int = 0
+    points_after: int = 0
+
+
+def rdp_mask(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Ramer–Douglas–Peucker simplification of an (N, 2) array of points.
+
+    Each segment's point distances are computed in one vectorized operation.
+
+    Returns:
+        A boolean mask of the points to keep.
+    """
+    count = len(points)
+    keep = np.zeros(count, dtype=bool)
+
+    if count < 3:
+        keep[:] = True
+        return keep
+
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+
+    while stack:
+        start, end = stack.pop()
+
+        if end - start < 2:
+            continue
+
+        first, last = points[start], points[end]
+        inner = points[start + 1 : end] - first
+        direction = last - first
+        length = np.hypot(direction[0], direction[1])
+
+        if length == 0:
+            distances = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            distances = (
+                np.abs(direction[0] * inner[:, 1] - direction[1] * inner[:, 0]) / length
+            )
+
+        index = int(np.argmax(distances))
+
+        if distances[index] > tolerance:
+            split = start + 1 + index
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return keep
+
+
+def simplify_points(
+    points: list[float | int], tolerance: float, precision: int
+) -> list[float | int]:
+    """
+    Simplifies a flat [x0, y0, x1, y1, ...] point list and rounds the
+    coordinates to `precision` decimals (whole numbers for 0).
+    """
+    if len(points) % 2:
+        return points
+
+    coordinates = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+    if tolerance > 0:
+        coordinates = coordinates[rdp_mask(coordinates, tolerance)]
+
+    coordinates = np.round(coordinates, precision)
+
+    if precision == 0:
+        return coordinates.astype(np.int64).ravel().tolist()
+
+    return coordinates.ravel().tolist()
+
+
+def simplify_lines(
+    lines: list[Line], tolerance: float, precision: int
+) -> tuple[list[Line], SimplifyStats]:
+    stats = SimplifyStats(lines=len(lines))
+    simplified: list[Line] = []
+
+    for line in lines:
+        points = simplify_points(line.points, tolerance, precision)
+        stats.points_before += len(line.points) // 2
+        stats.points_after += len(points) // 2
+        simplified.append(line.model_copy(update={"points": points}))
+
+    return simplified, stats
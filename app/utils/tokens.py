@@ -0,0 +1,104 @@
+import logging, math, threading, time
+from app.core.config import get_settings
+
+settings = get_settings()
+
+logger = logging.getLogger(__name__)
+
+# every message carries a few tokens of role and framing on top of its content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# seconds between attempts to load a tokenizer that failed to load
+TOKENIZER_RETRY_INTERVAL = 60
+
+_encodings = {}
+_load_attempts: dict[str, float] = {}
+_load_lock = threading.Lock()
+
+
+def load_tokenizer(model: str = settings.tokenizer_model) -> bool:
+    """
+    Loads the tokenizer for `model`, downloading its vocabulary on first use,
+    so call it off the event loop. Until it has loaded, token counts are
+    estimated. Returns whether it loaded.
+    """
+    with _load_lock:
+        _load_attempts[model] = time.monotonic()
+
+    try:
+        import tiktoken
+
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+    except Exception:
+        logger.warning("No tokenizer for %s, estimating token counts", model)
+        return False
+
+    _encodings[model] = encoding
+    return True
+
+
+def _encoding(model: str):
+    """
+    Returns the loaded tokenizer for `model`, or None while it is not loaded.
+    Loading, and retrying a failed load now and then, happens in a background
+    thread, so a transient download error does not disable it for good.
+    """
+    encoding = _encodings.get(model)
+
+    if encoding is None:
+        with _load_lock:
+            last_attempt = _load_attempts.get(model)
+            retry = (
+                last_attempt is None
+                or time.monotonic() - last_attempt > TOKENIZER_RETRY_INTERVAL
+            )
+
+            if retry:
+                _load_attempts[model] = time.monotonic()
+
+        if retry:
+            threading.Thread(target=load_tokenizer, args=(model,), daemon=True).start()
+
+    return encoding
+
+
+def count_text_tokens(text: str, model: str = settings.tokenizer_model) -> int:
+    encoding = _encoding(model)
+
+    if encoding is None:
+        return math.ceil(len(text) / 4)
+
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "auto") -> int:
+    """
+    Estimates the tokens of an image input from its size the way OpenAI bills
+    them: the image is scaled to fit 2048x2048, then its shortest side to 768,
+    and costs 170 tokens per 512px tile plus 85. Low detail is always 85.
+    """
+    if detail == "low" or width <= 0 or height <= 0:
+        return 85
+
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def message_tokens(content: str, image_size: tuple[int, int] | None = None) -> int:
+    """
+    Counts the tokens a stored message takes up as model input.
+    """
+    tokens = MESSAGE_OVERHEAD_TOKENS + count_text_tokens(content)
+
+    if image_size is not None:
+        tokens += MESSAGE_OVERHEAD_TOKENS + estimate_image_tokens(*image_size)
+
+    return tokens
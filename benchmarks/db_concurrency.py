@@ -0,0 +1,97 @@
+"""
+Compares the default and "production" database profiles under concurrent
+chat turns, each reading recent history and then storing two messages.
+
+    python -m benchmarks.db_concurrency --users 50 --turns 20
+"""
+
+import argparse, asyncio, os, statistics, tempfile, time
+
+# keep the app's own database out of the way while importing it
+workdir = tempfile.mkdtemp(prefix="db_concurrency_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{workdir}/app.db")
+
+from sqlmodel import desc, select
+from app.core.database import Database
+from app.models.db import Message, Session, User
+
+
+async def chat_turn(database: Database, user_id, session_id) -> float:
+    started = time.perf_counter()
+
+    async with database.async_session() as session:
+        (
+            await session.exec(
+                select(Message)
+                .where(Message.user_id == user_id)
+                .order_by(desc(Message.timestamp))
+                .limit(20)
+            )
+        ).all()
+
+    async with database.async_session() as session:
+        session.add_all(
+            [
+                Message(user_id=user_id, session_id=session_id, role=role, content=text)
+                for role, text in (
+                    ("user", "prompt " * 20),
+                    ("assistant", "answer " * 200),
+                )
+            ]
+        )
+        await session.commit()
+
+    return time.perf_counter() - started
+
+
+async def run_user(database: Database, turns: int, timings: list, errors: list):
+    async with database.async_session() as session:
+        user = User(email=f"{os.urandom(6).hex()}@example.com", hashed_password="")
+        visit = Session(user_id=user.id)
+        session.add_all([user, visit])
+        await session.commit()
+
+    for _ in range(turns):
+        try:
+            timings.append(await chat_turn(database, user.id, visit.id))
+        except Exception as e:
+            errors.append(e)
+
+
+async def measure(profile: str, users: int, turns: int) -> None:
+    database = Database(
+        url=f"sqlite:///{workdir}/{profile}.db", use_async=True, profile=profile
+    )
+    timings: list[float] = []
+    errors: list[Exception] = []
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(run_user(database, turns, timings, errors) for _ in range(users))
+    )
+    elapsed = time.perf_counter() - started
+
+    await database.dispose()
+
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1] if timings else 0.0
+
+    print(
+        f"{profile:>10}: {len(timings) / elapsed:8.1f} turns/s, "
+        f"p50 {statistics.median(timings) * 1000 if timings else 0:7.1f} ms, "
+        f"p95 {p95 * 1000:7.1f} ms, {len(errors)} errors"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+
+    for profile in ("default", "production"):
+        asyncio.run(measure(profile, args.users, args.turns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Compares validating a large DrawDeltaRequest with plain `Line` points against
+`CompactLine` packed points.
+
+    python -m benchmarks.line_schemas --lines 2000 --points 500
+"""
+
+import argparse, time, tracemalloc
+import numpy as np
+import orjson
+from app.models.schemas import CompactLine, DrawDeltaRequest, Line
+
+
+def make_lines(line_count: int, point_count: int) -> list[Line]:
+    rng = np.random.default_rng(0)
+
+    return [
+        Line(
+            points=(rng.integers(0, 4000, point_count * 2) / 2).tolist(),
+            color="#000000",
+            size=4,
+            opacity=1.0,
+            timestamp=index,
+            type=0,
+        )
+        for index in range(line_count)
+    ]
+
+
+def measure(label: str, body: bytes, repeat: int) -> None:
+    timings = []
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        DrawDeltaRequest.model_validate_json(body)
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    request = DrawDeltaRequest.model_validate_json(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{label:>8}: {len(body) / 1e6:7.2f} MB body, "
+        f"{min(timings) * 1000:8.1f} ms validate, "
+        f"{peak / 1e6:7.2f} MB peak ({len(request.lines)} lines)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=2000)
+    parser.add_argument("--points", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    lines = make_lines(args.lines, args.points)
+    compact = [CompactLine.from_line(line) for line in lines]
+
+    assert all(line == packed.to_line() for line, packed in zip(lines, compact))
+
+    plain_body = orjson.dumps({"lines": [line.model_dump() for line in lines]})
+    compact_body = orjson.dumps({"lines": [line.model_dump() for line in compact]})
+
+    measure("plain", plain_body, args.repeat)
+    measure("compact", compact_body, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
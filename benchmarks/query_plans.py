@@ -0,0 +1,97 @@
+"""
+Checks with SQLite's EXPLAIN QUERY PLAN that the history and context queries
+are served by the composite message indexes, and prints their plans.
+
+    python -m benchmarks.query_plans
+"""
+
+import os, tempfile
+
+# keep the app's own database out of the way while importing it
+workdir = tempfile.mkdtemp(prefix="query_plans_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{workdir}/app.db")
+
+from datetime import datetime
+from uuid import uuid4
+from sqlalchemy import text
+from sqlmodel import SQLModel, Session, create_engine, desc, select, tuple_
+from app.models.db import Message, Session as Visit
+
+user_id, session_id, message_id = uuid4(), uuid4(), uuid4()
+now = datetime.now()
+
+# each query the app runs, with the index it must use
+QUERIES = {
+    "history page": (
+        select(Message)
+        .where(Message.user_id == user_id)
+        .order_by(desc(Message.timestamp), desc(Message.id))
+        .limit(11),
+        "ix_message_user_id_timestamp_id",
+    ),
+    "history page after cursor": (
+        select(Message)
+        .where(Message.user_id == user_id)
+        .where(tuple_(Message.timestamp, Message.id) < tuple_(now, message_id))
+        .order_by(desc(Message.timestamp), desc(Message.id))
+        .limit(11),
+        "ix_message_user_id_timestamp_id",
+    ),
+    "user context": (
+        select(Message)
+        .where(Message.user_id == user_id)
+        .order_by(desc(Message.timestamp))
+        .limit(50),
+        "ix_message_user_id_timestamp_id",
+    ),
+    "visit context": (
+        select(Message)
+        .where(Message.session_id == session_id)
+        .order_by(desc(Message.timestamp))
+        .limit(50),
+        "ix_message_session_id_timestamp",
+    ),
+    "active visit": (
+        select(Visit).where((Visit.user_id == user_id) & (Visit.finished_at == None)),
+        "ix_session_user_id_active",
+    ),
+}
+
+
+def query_plan(session: Session, statement) -> list[str]:
+    compiled = statement.compile(
+        dialect=session.get_bind().dialect, compile_kwargs={"literal_binds": True}
+    )
+    rows = session.exec(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+
+    return [row[-1] for row in rows]
+
+
+def main():
+    engine = create_engine(f"sqlite:///{workdir}/plans.db")
+    SQLModel.metadata.create_all(engine)
+    failures = []
+
+    with Session(engine) as session:
+        for label, (statement, index) in QUERIES.items():
+            plan = query_plan(session, statement)
+            used = any(index in step for step in plan)
+
+            print(f"{label}: {'ok' if used else 'MISSING ' + index}")
+
+            for step in plan:
+                print(f"  {step}")
+
+            if not used:
+                failures.append(label)
+
+    engine.dispose()
+
+    if failures:
+        raise SystemExit(f"Queries not using their index: {', '.join(failures)}")
+
+    print("All queries use their index")
+
+
+if __name__ == "__main__":
+    main()
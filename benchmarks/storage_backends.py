@@ -0,0 +1,116 @@
+"""
+Checks that the local and S3 storage backends behave alike and compares the
+time they take for the operations the app uses.
+
+S3 runs against moto's in-process mock by default (`pip install moto`), or
+against MinIO or any other S3-compatible server with `--endpoint-url`:
+
+    python -m benchmarks.storage_backends
+    python -m benchmarks.storage_backends --endpoint-url http://localhost:9000 \\
+        --bucket studio-visit --access-key-id minioadmin --secret-access-key minioadmin
+"""
+
+import argparse, contextlib, io, os, tempfile, time
+from app.core.storage import LocalStorage, S3Storage, Storage
+
+
+def check(storage: Storage, size: int) -> dict[str, float]:
+    timings: dict[str, float] = {}
+    data = os.urandom(size)
+
+    @contextlib.contextmanager
+    def timed(name: str):
+        started = time.perf_counter()
+        yield
+        timings[name] = time.perf_counter() - started
+
+    with timed("write bytes"):
+        storage.write("user/a.png", data, content_type="image/png")
+
+    with timed("write stream"):
+        storage.write("user/nested/b.png", io.BytesIO(data), content_type="image/png")
+
+    with timed("exists"):
+        assert storage.exists("user/a.png")
+        assert not storage.exists("user/missing.png")
+
+    with timed("read"):
+        assert storage.read("user/a.png") == data
+
+    with timed("iter_chunks"):
+        assert b"".join(storage.iter_chunks("user/nested/b.png")) == data
+
+    with timed("local_path"):
+        with storage.local_path("user/a.png") as path, open(path, "rb") as f:
+            assert f.read() == data
+
+    for key in ("../escape.png", "/absolute.png", "."):
+        try:
+            storage.normalize_key(key)
+        except ValueError:
+            continue
+
+        raise AssertionError(f"{key!r} was accepted as a storage key")
+
+    storage.write("other/c.png", data)
+
+    with timed("delete_prefix"):
+        storage.delete_prefix("user")
+
+    assert not storage.exists("user/a.png")
+    assert not storage.exists("user/nested/b.png")
+    assert storage.exists("other/c.png")
+
+    return timings
+
+
+def report(label: str, timings: dict[str, float]) -> None:
+    print(f"{label}:")
+
+    for name, seconds in timings.items():
+        print(f"  {name:>14}: {seconds * 1000:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=1024 * 1024)
+    parser.add_argument("--endpoint-url", default=None)
+    parser.add_argument("--bucket", default="studio-visit")
+    parser.add_argument("--region", default="us-east-1")
+    parser.add_argument("--access-key-id", default="testing")
+    parser.add_argument("--secret-access-key", default="testing")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        report("local", check(LocalStorage(root), args.size))
+
+    if args.endpoint_url:
+        mock = contextlib.nullcontext()
+    else:
+        from moto import mock_aws
+
+        mock = mock_aws()
+
+    with mock:
+        storage = S3Storage(
+            bucket=args.bucket,
+            prefix="uploads",
+            endpoint_url=args.endpoint_url,
+            region=args.region,
+            access_key_id=args.access_key_id,
+            secret_access_key=args.secret_access_key,
+        )
+
+        if not args.endpoint_url:
+            storage._client.create_bucket(Bucket=args.bucket)
+
+        report("s3", check(storage, args.size))
+
+        url = storage.presigned_url("other/c.png")
+        assert url and args.bucket in url and "uploads/other/c.png" in url
+
+    print("Both backends passed")
+
+
+if __name__ == "__main__":
+    main()
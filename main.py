@@ -1,14 +1,48 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.routers import auth, chat, history, visit
+from app.api.middleware import UploadSizeLimitMiddleware
+from app.api.routers import admin, auth, chat, history, visit
+from app.core.config import get_settings
 from app.core.database import db
+from app.core.image_processor import image_processor
+from app.core.vector_index import vector_index
+from app.services.deletion_queue import deletion_queue
+from app.services.message_writer import message_writer
+from app.services.summarizer import summarizer
+from app.utils.tokens import load_tokenizer
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(load_tokenizer)
+    await deletion_queue.resume()
+    yield
+    await deletion_queue.shutdown()
+    await message_writer.shutdown()
+    await summarizer.shutdown()
+    await vector_index.shutdown()
+    image_processor.shutdown()
+    await db.dispose()
+
+
+settings = get_settings()
+
+app = FastAPI(lifespan=lifespan)
 
 sql_db = db
 
 origins = ["http://localhost:3000", "https://www.woutervanderlaan.com"]
 
+# multipart framing adds a little on top of the file itself; added before
+# CORSMiddleware so that the 413 response still carries CORS headers
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    paths=["/chat/image-critique"],
+    max_bytes=settings.max_upload_bytes + 64 * 1024,
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -21,3 +55,4 @@ app.include_router(auth.router)
 app.include_router(chat.router)
 app.include_router(history.router)
 app.include_router(visit.router)
+app.include_router(admin.router)